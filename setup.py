@@ -24,9 +24,9 @@ setup(
   license = "MIT",
   packages = find_packages(),
   python_requires=">=3.7",
-  install_requires = ["python-slugify", "motor", "dataclasses-jsonschema", "sanic", "sanic-jinja2", "pyJWT"],
+  install_requires = ["python-slugify", "motor", "dataclasses-jsonschema", "fastjsonschema", "jsonschema", "sanic", "sanic-jinja2", "pyJWT"],
   extras_requires = {
-    "dev": ["pytest", "Faker", "pytest-cov"]
+    "dev": ["pytest", "Faker", "pytest-cov", "aiosmtpd"]
   },
   test_suite = "pytest"
 )
@@ -0,0 +1,38 @@
+"""Compares the generated hydrators with cls(**doc)
+
+  python tests/benchmark_hydrators.py [documents]
+"""
+from sys import argv
+from timeit import timeit
+from typing import List
+from dataclasses import dataclass, field
+
+from bson import ObjectId
+
+from yrest.tree import Tree
+from yrest.mongo import Mongo
+from yrest.hydrator import hydrator
+
+@dataclass
+class Task(Tree, Mongo):
+  name: str = None
+  description: str = None
+  done: bool = False
+  tags: List[str] = field(default_factory = list)
+  tasks: List[str] = field(default_factory = list, metadata = {"model": "Task"})
+
+def main():
+  number = int(argv[1]) if len(argv) > 1 else 100000
+  docs = [
+    {"_id": ObjectId(), "path": "/tasks", "slug": f"task-{idx}", "type": "Task", "name": f"Task {idx}", "tags": ["a", "b"], "tasks": []}
+    for idx in range(number)
+  ]
+  hydrate = hydrator(Task)
+
+  init = timeit(lambda: [Task(**doc) for doc in docs], number = 1)
+  generated = timeit(lambda: [hydrate(doc) for doc in docs], number = 1)
+  print(f"cls(**doc): {init * 1e6 / number:.2f} us/doc")
+  print(f"hydrator:   {generated * 1e6 / number:.2f} us/doc ({init / generated:.1f}x)")
+
+if __name__ == "__main__":
+  main()
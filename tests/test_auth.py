@@ -0,0 +1,36 @@
+from asyncio import get_event_loop, gather
+from time import sleep
+
+from sanic.exceptions import ServiceUnavailable
+
+from yrest.auth import Auth, PasswordHasher, check_password_hash
+
+class TestPasswordHasher:
+  def test_hash_and_check(self):
+    hasher = PasswordHasher(workers = 1, queue_size = 0)
+    hashed = get_event_loop().run_until_complete(hasher.hash("secret"))
+
+    assert check_password_hash(hashed, "secret")
+    assert get_event_loop().run_until_complete(hasher.check(hashed, "secret"))
+    assert not get_event_loop().run_until_complete(hasher.check(hashed, "wrong"))
+    hasher.shutdown()
+
+  def test_rejects_when_saturated(self):
+    hasher = PasswordHasher(workers = 1, queue_size = 1)
+    async def run():
+      return await gather(*[hasher._run(sleep, 0.05) for _ in range(3)], return_exceptions = True)
+
+    results = get_event_loop().run_until_complete(run())
+    assert [isinstance(result, ServiceUnavailable) for result in results] == [False, False, True]
+    assert hasher.rejected == 1 and hasher.pending == 0
+    hasher.shutdown()
+
+  def test_secure_sync_and_async(self):
+    hashed = Auth.secure("secret")
+    assert check_password_hash(hashed, "secret") and Auth.secure(hashed) == hashed
+
+    hasher = PasswordHasher(workers = 1, queue_size = 0)
+    hashed = get_event_loop().run_until_complete(Auth.asecure("secret", hasher))
+    assert check_password_hash(hashed, "secret")
+    assert get_event_loop().run_until_complete(Auth.asecure(hashed, hasher)) == hashed
+    hasher.shutdown()
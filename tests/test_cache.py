@@ -0,0 +1,86 @@
+from asyncio import get_event_loop
+from time import monotonic, time
+
+from yrest.cache import Cache, ActorCache, PermissionCache, MISSING
+
+class User:
+  def __init__(self, _id):
+    self._id = _id
+
+class TestCache:
+  def test_hits_and_misses(self):
+    cache = Cache()
+    assert cache.get("key") is None
+    cache.set("key", "value")
+    assert cache.get("key") == "value"
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+  def test_caches_none(self):
+    cache = Cache()
+    cache.set("key", None)
+    assert cache.get("key", MISSING) is None
+
+  def test_lru_bound(self):
+    cache = Cache(maxsize = 2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+
+  def test_expires(self):
+    cache = Cache()
+    cache.set("key", "value", expires = monotonic() - 1)
+    assert cache.get("key") is None
+    assert len(cache) == 0
+
+  def test_ttl_caps_expires(self):
+    cache = Cache(ttl = -1)
+    cache.set("key", "value", expires = monotonic() + 60)
+    assert cache.get("key") is None
+
+class TestActorCache:
+  def test_invalidate(self):
+    cache = ActorCache(User)
+    cache.set("token1", {"_id": 1})
+    cache.set("token2", {"_id": 1})
+    assert cache.get("token1") == {"_id": 1}
+    cache.invalidate(User(1))
+    assert cache.get("token1") is None
+    assert cache.get("token2") is None
+
+  def test_never_outlives_exp(self):
+    cache = ActorCache(User)
+    cache.set("token", {"_id": 1}, exp = time() - 1)
+    assert cache.get("token") is None
+
+  def test_gets_are_copies(self):
+    cache = ActorCache(User)
+    cache.set("token", {"_id": 1, "roles": ["admin"]})
+    cache.get("token")["roles"].append("owner@/a")
+    assert cache.get("token") == {"_id": 1, "roles": ["admin"]}
+
+class Permission:
+  def __init__(self, context, name):
+    self.context, self.name = context, name
+
+  @classmethod
+  async def gets(cls, table):
+    return table
+
+  @classmethod
+  async def get(cls, table, context, name):
+    return next((perm for perm in table if perm.context == context and perm.name == name), None)
+
+class TestPermissionCache:
+  def test_load_and_expire(self):
+    table = [Permission("Folder", "get")]
+    cache = PermissionCache(Permission, ttl = 60)
+    get_event_loop().run_until_complete(cache.load(table))
+    assert get_event_loop().run_until_complete(cache.get([], "Folder", "get")) is table[0]
+
+    cache.configure(ttl = -1)
+    get_event_loop().run_until_complete(cache.load(table))
+    assert get_event_loop().run_until_complete(cache.get([], "Folder", "get")) is None
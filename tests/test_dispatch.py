@@ -0,0 +1,100 @@
+from asyncio import get_event_loop
+from dataclasses import dataclass
+from json import loads
+from types import ModuleType, SimpleNamespace
+
+import pytest
+
+from sanic.exceptions import NotFound
+
+from yrest.tree import Tree
+from yrest.mongo import Mongo
+from yrest.metrics import Stopwatch
+from yrest import ysanic
+from yrest.ysanic import ySanic, Streamed, _stream
+
+@dataclass
+class Page(Tree, Mongo):
+  name: str = None
+
+class FakeTable:
+  """Answers the $or of (path, slug) pairs get_path sends, shallowest documents first"""
+  def __init__(self, docs):
+    self.docs = docs
+    self.queries = []
+
+  def find(self, query):
+    self.queries.append(query)
+    return self._find(query)
+
+  async def _find(self, query):
+    for doc in self.docs:
+      if any(doc["path"] == cond["path"] and cond.get("slug", doc["slug"]) == doc["slug"] for cond in query["$or"]):
+        yield dict(doc)
+
+@pytest.fixture
+def app():
+  table = FakeTable([
+    {"path": "/", "slug": "a", "type": "Page", "name": "a"},
+    {"path": "/a", "slug": "b", "type": "Page", "name": "b"}
+  ])
+  return SimpleNamespace(_table = table, _root_model = Page)
+
+@pytest.fixture
+def models():
+  models = ModuleType("models")
+  models.Page = Page
+  return models
+
+class TestGetPath:
+  def test_picks_the_deepest_match(self, app, models):
+    paper = get_event_loop().run_until_complete(ySanic.get_path(app, "/a/b/call", models, 2))
+
+    assert paper.name == "b"
+    assert len(app._table.queries) == 1
+    assert app._table.queries[0]["$or"] == [{"path": "/a/b", "slug": "call"}, {"path": "/a", "slug": "b"}, {"path": "/", "slug": "a"}]
+
+  def test_tolerance_bounds_the_candidates(self, app, models):
+    with pytest.raises(NotFound):
+      get_event_loop().run_until_complete(ySanic.get_path(app, "/a/b/call/more", models, 1))
+
+class FakeStream:
+  def __init__(self):
+    self.writes = []
+
+  async def write(self, data):
+    self.writes.append(data)
+
+async def pages(fail = False):
+  yield {"name": "a"}
+  yield Page(path = "/", name = "b")
+  if fail:
+    raise ValueError("cursor lost")
+
+def streamed(monkeypatch, result, flush_size = 16384):
+  monkeypatch.setattr(ysanic.response, "stream", lambda streaming_fn, **kwargs: streaming_fn)
+  streaming_fn = _stream(SimpleNamespace(_observe = lambda *args: None), "dispatcher", result, Stopwatch(), 0, 0, flush_size)
+  stream = FakeStream()
+  get_event_loop().run_until_complete(streaming_fn(stream))
+  return stream.writes
+
+class TestStream:
+  def test_ndjson_ends_with_the_trailer(self, monkeypatch):
+    lines = "".join(streamed(monkeypatch, Streamed(pages(), ndjson = True))).splitlines()
+
+    assert [loads(line)["name"] for line in lines[:2]] == ["a", "b"]
+    assert loads(lines[2])["ok"] and loads(lines[2])["count"] == 2
+
+  def test_json_array_with_the_envelope_after_it(self, monkeypatch):
+    writes = streamed(monkeypatch, Streamed(pages()), flush_size = 1)
+    body = loads("".join(writes))
+
+    assert len(writes) == 3
+    assert [item["name"] for item in body["result"]] == ["a", "b"]
+    assert body["ok"] and body["code"] == 200 and body["count"] == 2
+
+  def test_errors_go_to_the_trailer(self, monkeypatch):
+    body = loads("".join(streamed(monkeypatch, Streamed(pages(fail = True)))))
+
+    assert [item["name"] for item in body["result"]] == ["a", "b"]
+    assert not body["ok"] and body["code"] == 500 and body["message"] == "cursor lost"
@@ -0,0 +1,37 @@
+from typing import List
+from dataclasses import dataclass, field
+
+from yrest.tree import Tree
+from yrest.mongo import Mongo
+from yrest.hydrator import hydrator
+
+@dataclass
+class Folder(Tree, Mongo):
+  name: str = None
+  items: List[str] = field(default_factory = list)
+
+@dataclass
+class Checked(Tree, Mongo):
+  name: str = None
+
+  def __post_init__(self):
+    super().__post_init__()
+    self.name = self.name.strip()
+
+class TestHydrator:
+  def test_matches_init(self):
+    doc = {"_id": "x", "path": "/", "slug": "f", "type": "Folder", "name": "f", "items": ["a"], "unknown": 1}
+    folder = hydrator(Folder)(doc)
+
+    assert folder == Folder(_id = "x", path = "/", slug = "f", type = "Folder", name = "f", items = ["a"])
+    assert not hasattr(folder, "unknown")
+
+  def test_defaults(self):
+    doc = {"path": "/", "name": "A folder"}
+    first, second = hydrator(Folder)(doc), hydrator(Folder)(doc)
+
+    assert first.items == [] and first.items is not second.items
+    assert (first.type, first.slug) == ("Folder", "a-folder")
+
+  def test_custom_post_init_runs(self):
+    assert hydrator(Checked)({"path": "/", "name": " a ", "unknown": 1}).name == "a"
@@ -0,0 +1,69 @@
+from json import dumps, loads
+from typing import Any, Dict, List
+from dataclasses import dataclass, field
+
+import pytest
+
+from bson import ObjectId, encode
+from bson.raw_bson import RawBSONDocument
+
+from yrest.tree import Tree
+from yrest.mongo import Mongo, MongoJSONEncoder
+from yrest.lazy import LazyView
+from yrest.serializer import serializer
+from yrest.utils import OkResult, OkListResult
+
+@dataclass
+class Page(Tree, Mongo):
+  name: str = None
+  tags: List[str] = field(default_factory = list)
+
+  def title(self) -> str:
+    return self.name.upper()
+
+@dataclass
+class Report(Tree, Mongo):
+  meta: Dict[str, Any] = None
+  blocks: List[Dict] = field(default_factory = list)
+
+@pytest.fixture
+def view():
+  doc = RawBSONDocument(encode({"_id": ObjectId(), "path": "/", "slug": "home", "type": "Page", "name": "home", "ancestors": []}))
+  return LazyView(Page, doc)
+
+class TestLazyView:
+  def test_reads_fields_and_methods(self, view):
+    assert view.name == "home"
+    assert view.tags == []
+    assert view._ancestors == []
+    assert view.get_url() == "/home"
+    assert view.title() == "HOME"
+
+  def test_is_read_only(self, view):
+    with pytest.raises(AttributeError):
+      view.name = "other"
+
+  def test_hydrate_and_serialize(self, view):
+    page = view.hydrate()
+    assert isinstance(page, Page)
+    assert page._ancestors == []
+    assert view.to_plain_dict() == page.to_plain_dict()
+
+  def test_serializes_inside_the_envelopes(self, view):
+    for envelope in (OkResult(result = view), OkListResult(result = [view])):
+      body = loads(dumps(serializer(envelope.__class__)(envelope), cls = MongoJSONEncoder))
+      result = body["result"] if isinstance(envelope, OkResult) else body["result"][0]
+      assert result == loads(dumps(view.to_plain_dict(), cls = MongoJSONEncoder))
+
+  def test_sub_documents_are_decoded(self):
+    _id = ObjectId()
+    doc = RawBSONDocument(encode({"_id": _id, "path": "/", "slug": "r", "type": "Report", "meta": {"by": _id, "nested": {"a": 1}}, "blocks": [{"kind": "text"}]}))
+    view = LazyView(Report, doc)
+
+    assert view.meta == {"by": _id, "nested": {"a": 1}} and isinstance(view.meta, dict)
+    assert view.blocks == [{"kind": "text"}]
+    expected = {"by": str(_id), "nested": {"a": 1}}
+    assert loads(dumps(view.to_plain_dict(), cls = MongoJSONEncoder))["meta"] == expected
+    for envelope in (OkResult(result = view), OkListResult(result = [view])):
+      body = dumps(serializer(envelope.__class__)(envelope), cls = MongoJSONEncoder)
+      assert '"blocks":[{"kind":"text"}]' in body.replace(" ", "")
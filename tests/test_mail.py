@@ -0,0 +1,105 @@
+from asyncio import get_event_loop
+from socket import socket
+
+import pytest
+
+from aiosmtplib import SMTPServerDisconnected
+
+from yrest.mail import Mailer, build_message
+
+class FakeSMTP:
+  connections = []
+  failures = 0
+
+  def __init__(self, hostname, port, **kwargs):
+    self.sent = []
+    self.is_connected = False
+    FakeSMTP.connections.append(self)
+
+  async def connect(self):
+    self.is_connected = True
+
+  async def send_message(self, message):
+    if FakeSMTP.failures:
+      FakeSMTP.failures -= 1
+      self.is_connected = False
+      raise SMTPServerDisconnected("Dropped")
+    self.sent.append(message["Subject"])
+    return ({}, "OK")
+
+  def close(self):
+    self.is_connected = False
+
+  async def quit(self):
+    self.is_connected = False
+
+@pytest.fixture
+def fake_smtp():
+  FakeSMTP.connections, FakeSMTP.failures = [], 0
+  return FakeSMTP
+
+def deliver(mailer, subjects):
+  async def run():
+    handles = [mailer.enqueue(await build_message("a@b.c", "d@e.f", subject, text = "Hi")) for subject in subjects]
+    await mailer.stop(5)
+    return handles
+
+  return get_event_loop().run_until_complete(run())
+
+class TestMailer:
+  def test_batches_on_one_connection(self, fake_smtp):
+    mailer = Mailer("localhost", 25, workers = 1, batch_size = 10, connection_class = fake_smtp)
+    handles = deliver(mailer, ["1", "2", "3"])
+
+    assert [handle.status for handle in handles] == ["sent"] * 3
+    assert len(fake_smtp.connections) == 1
+    assert fake_smtp.connections[0].sent == ["1", "2", "3"]
+
+  def test_retries_with_a_new_connection(self, fake_smtp):
+    fake_smtp.failures = 1
+    mailer = Mailer("localhost", 25, workers = 1, backoff = 0.01, connection_class = fake_smtp)
+    handles = deliver(mailer, ["1", "2"])
+
+    assert [handle.status for handle in handles] == ["sent", "sent"]
+    assert handles[0].attempts == 2
+    assert len(fake_smtp.connections) == 2
+
+  def test_gives_up(self, fake_smtp):
+    fake_smtp.failures = 10
+    mailer = Mailer("localhost", 25, workers = 1, retries = 2, backoff = 0.01, connection_class = fake_smtp)
+    handle, = deliver(mailer, ["1"])
+
+    assert handle.status == "failed" and handle.attempts == 2
+
+  def test_attachments_and_missing_body(self, tmp_path):
+    attachment = tmp_path / "notes.txt"
+    attachment.write_text("notes")
+    message = get_event_loop().run_until_complete(build_message("a@b.c", "d@e.f", "Hi", html = "<p>Hi</p>", attachments = [str(attachment), "missing.txt"]))
+    assert len(message.get_payload()) == 2
+
+    with pytest.raises(ValueError):
+      get_event_loop().run_until_complete(build_message("a@b.c", "d@e.f", "Hi"))
+
+  def test_against_aiosmtpd(self):
+    controller_module = pytest.importorskip("aiosmtpd.controller")
+    from aiosmtpd.handlers import Sink
+
+    class Handler(Sink):
+      received = []
+      async def handle_DATA(self, server, session, envelope):
+        self.received.append(envelope)
+        return "250 OK"
+
+    with socket() as probe:
+      probe.bind(("127.0.0.1", 0))
+      port = probe.getsockname()[1]
+
+    controller = controller_module.Controller(Handler(), hostname = "127.0.0.1", port = port)
+    controller.start()
+    try:
+      mailer = Mailer("127.0.0.1", port, start_tls = False)
+      handles = deliver(mailer, ["1", "2"])
+      assert [handle.status for handle in handles] == ["sent", "sent"]
+      assert len(Handler.received) == 2
+    finally:
+      controller.stop()
@@ -0,0 +1,25 @@
+from yrest.metrics import Metrics, Histogram, Stopwatch
+
+class TestMetrics:
+  def test_histogram_quantile(self):
+    histogram = Histogram((0.1, 1, 10))
+    for value in (0.05, 0.5, 0.5, 5):
+      histogram.observe(value)
+    assert histogram.count == 4
+    assert histogram.quantile(0.5) == 1
+    assert histogram.quantile(0.99) == 10
+
+  def test_render(self):
+    metrics = Metrics((0.1, 1))
+    metrics.observe("latency", 0.5, route = "dispatcher", member = "index")
+    text = metrics.render()
+    assert "# TYPE latency histogram" in text
+    assert 'latency_bucket{member="index",route="dispatcher",le="1.0"} 1' in text
+    assert 'latency_count{member="index",route="dispatcher"} 1' in text
+
+  def test_stopwatch(self):
+    timer = Stopwatch()
+    with timer.stage("get_path"):
+      pass
+    timer.add("get_path", 0.001)
+    assert timer.server_timing().startswith("get_path;dur=")
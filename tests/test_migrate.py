@@ -0,0 +1,54 @@
+from asyncio import get_event_loop
+from types import SimpleNamespace
+
+from yrest.migrate import backfill_ancestors
+
+class FakeCursor:
+  def __init__(self, docs):
+    self._docs = docs
+
+  def sort(self, key, direction):
+    return FakeCursor(sorted(self._docs, key = lambda doc: doc[key]))
+
+  def __aiter__(self):
+    self._iter = iter(self._docs)
+    return self
+
+  async def __anext__(self):
+    try:
+      return next(self._iter)
+    except StopIteration:
+      raise StopAsyncIteration
+
+class FakeTable:
+  def __init__(self, docs):
+    self.docs = docs
+    self.updates = {}
+
+  def find(self, query, projection):
+    return FakeCursor(self.docs)
+
+  async def bulk_write(self, actions, ordered = True):
+    for action in actions:
+      self.updates[action._filter["_id"]] = action._doc["$set"]
+    return SimpleNamespace(modified_count = len(actions))
+
+  async def create_index(self, keys):
+    pass
+
+class TestMigrate:
+  def test_backfill_ancestors(self):
+    docs = [
+      {"_id": 4, "path": "/a/b", "slug": "c"},
+      {"_id": 5, "path": "/", "slug": "ab"},
+      {"_id": 2, "path": "/", "slug": "a"},
+      {"_id": 1, "path": "", "slug": "root"},
+      {"_id": 3, "path": "/a", "slug": "b"}
+    ]
+    table = FakeTable(docs)
+    updated = get_event_loop().run_until_complete(backfill_ancestors(table, batch_size = 2))
+
+    assert updated == 5
+    assert table.updates[1] == {"ancestors": [], "depth": 0}
+    assert table.updates[5] == {"ancestors": [1], "depth": 1}
+    assert table.updates[4] == {"ancestors": [1, 2, 3], "depth": 3}
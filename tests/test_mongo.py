@@ -1,9 +1,390 @@
+import re
+import pytest
 from unittest.mock import Mock
+from types import ModuleType
+from asyncio import get_event_loop
+from typing import List
+from dataclasses import dataclass, field
 
-from mongo import MongoBase
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from mongo import MongoBase, Mongo, table_uow
+from tree import Tree
+
+@dataclass
+class Item(Tree, Mongo):
+  name: str = None
+
+@dataclass
+class Folder(Tree, Mongo):
+  name: str = None
+  items: List[str] = field(default_factory = list, metadata = {"model": "Item"})
+  others: List[str] = field(default_factory = list, metadata = {"model": "Item"})
+
+@dataclass
+class Section(Tree, Mongo):
+  name: str = None
+  items: List[str] = field(default_factory = list, metadata = {"model": "Item"})
+  sections: List[str] = field(default_factory = list, metadata = {"model": "Section"})
+
+class FakeAggregation:
+  def __init__(self, result):
+    self._result = result
+
+  async def to_list(self, length):
+    return self._result
 
 class TestMongo:
   def test_get_doc(self):
     mongo_mock = Mock()
     print(MongoBase._get_doc(mongo_mock, path = "/garito"))
-    print(mongo_mock)
\ No newline at end of file
+    print(mongo_mock)
+
+  def test_subtree_query_is_anchored(self):
+    query = MongoBase._subtree_query("/foo")
+    matches = lambda path: any(
+      path == cond["path"] if isinstance(cond["path"], str) else cond["path"]["$gte"] <= path < cond["path"]["$lt"]
+      for cond in query["$or"]
+    )
+    assert matches("/foo")
+    assert matches("/foo/bar")
+    assert not matches("/foobar")
+    assert not matches("/fo")
+
+
+  def test_children_single_facet(self):
+    pipelines = []
+    def aggregate(pipeline):
+      pipelines.append(pipeline)
+      return FakeAggregation([{"items": [{"path": "/folder", "slug": "a", "type": "Item", "name": "a", "__order": 0}], "others": []}])
+
+    folder = Folder(path = "/", name = "folder", items = ["a"])
+    folder._table = Mock(aggregate = aggregate)
+    children = get_event_loop().run_until_complete(folder.children([Item]))
+
+    assert len(pipelines) == 1
+    assert set(pipelines[0][1]["$facet"].keys()) == {"items", "others"}
+    assert children["items"][0].name == "a"
+    assert children["others"] == []
+
+  def test_children_falls_back_when_facet_too_large(self):
+    pipelines = []
+    class TooLarge:
+      async def to_list(self, length):
+        raise OperationFailure("BSONObj size: 17000000 is invalid", 10334)
+
+    def aggregate(pipeline):
+      pipelines.append(pipeline)
+      if "$facet" in pipeline[-1]:
+        return TooLarge()
+      return FakeAggregation([{"path": "/folder", "slug": "a", "type": "Item", "name": "a", "__order": 0}] if len(pipelines) == 2 else [])
+
+    folder = Folder(path = "/", name = "folder", items = ["a"])
+    folder._table = Mock(aggregate = aggregate)
+    children = get_event_loop().run_until_complete(folder.children([Item]))
+
+    assert len(pipelines) == 3
+    assert children["items"][0].name == "a"
+    assert children["others"] == []
+
+  def test_agets_streams_objects(self):
+    calls = {}
+    class Cursor:
+      def limit(self, limit):
+        calls["limit"] = limit
+        return self
+
+      async def __aiter__(self):
+        for name in ("a", "b"):
+          yield {"path": "/", "slug": name, "type": "Item", "name": name}
+
+    def find(query, projection, batch_size):
+      calls.update(query = query, batch_size = batch_size)
+      return Cursor()
+
+    async def collect():
+      return [item async for item in Item.agets(Mock(find = find), batch_size = 10, limit = 2)]
+
+    items = get_event_loop().run_until_complete(collect())
+    assert [item.name for item in items] == ["a", "b"]
+    assert calls == {"query": {"type": "Item"}, "batch_size": 10, "limit": 2}
+
+  def test_subtree_depth(self):
+    docs = [
+      {"path": "/root", "slug": "a", "type": "Item", "name": "a"},
+      {"path": "/root", "slug": "sub", "type": "Section", "name": "sub", "items": ["b"]},
+      {"path": "/root/sub", "slug": "b", "type": "Item", "name": "b"},
+      {"path": "/root/sub/deeper", "slug": "c", "type": "Item", "name": "c"}
+    ]
+    def matches(cond, path):
+      return cond == path if isinstance(cond, str) else re.match(cond["$regex"], path) is not None
+
+    class Cursor:
+      def __init__(self, query):
+        self.query = query
+
+      async def __aiter__(self):
+        for doc in docs:
+          if any(matches(cond["path"], doc["path"]) for cond in self.query.get("$or", [self.query])):
+            yield doc
+
+    models = ModuleType("models")
+    models.Item, models.Section = Item, Section
+    section = Section(path = "/", name = "root", items = ["a"], sections = ["sub"])
+    section._table = Mock(find = Cursor)
+    tree = get_event_loop().run_until_complete(section.subtree(models, depth = 1))
+
+    assert tree["items"][0]["name"] == "a"
+    assert tree["sections"][0]["name"] == "sub"
+    assert tree["sections"][0]["items"] == ["b"]
+
+    section = Section(path = "/", name = "root", items = ["a"], sections = ["sub"])
+    section._table = Mock(find = Cursor)
+    async def allowed(obj):
+      return obj.name != "a"
+    tree = get_event_loop().run_until_complete(section.subtree(models, depth = 2, allowed = allowed))
+
+    assert tree["items"] == ["a"]
+    assert tree["sections"][0]["items"][0]["name"] == "b"
+
+  def test_subtree_query_limits_depth(self):
+    assert MongoBase._subtree_query("/foo", 1) == {"path": "/foo"}
+    pattern = MongoBase._subtree_query("/", 3)["$or"][1]["path"]["$regex"]
+    assert re.match(pattern, "/a/b") and not re.match(pattern, "/a/b/c")
+
+  def test_create_children_bulk(self):
+    calls = {}
+    class Session:
+      async def __aenter__(self):
+        return self
+
+      async def __aexit__(self, *args):
+        pass
+
+      def start_transaction(self):
+        return self
+
+    async def start_session():
+      return Session()
+
+    class Cursor:
+      async def __aiter__(self):
+        yield {"slug": "taken"}
+
+    async def insert_many(docs, ordered, session):
+      calls["docs"] = docs
+
+    async def update_one(query, update, session):
+      calls["update"] = update
+
+    section = Section(path = "/", name = "root", items = ["old"])
+    section._table = Mock(find = lambda query, projection, session: Cursor(), insert_many = insert_many, update_one = update_one)
+    section._table.database.client.start_session = start_session
+    children = [Item(name = "a"), Item(name = "taken"), Item(name = "a"), Section(name = "s")]
+    result = get_event_loop().run_until_complete(section.create_children(children, as_ = "items"))
+
+    assert [child.slug for child in result["created"]] == ["a"]
+    assert [error["index"] for error in result["errors"]] == [1, 2, 3]
+    assert [doc["path"] for doc in calls["docs"]] == ["/root"]
+    assert calls["update"] == {"$push": {"items": {"$each": ["a"]}}}
+    assert section.items == ["old", "a"]
+
+  def test_create_children_retries_without_failed_writes(self):
+    calls = {"docs": [], "lineage": 0}
+    class Session:
+      async def __aenter__(self):
+        return self
+
+      async def __aexit__(self, *args):
+        pass
+
+      def start_transaction(self):
+        return self
+
+    async def start_session():
+      return Session()
+
+    class Cursor:
+      async def __aiter__(self):
+        return
+        yield
+
+    async def find_one(query, projection):
+      calls["lineage"] += 1
+      return {"_id": "root_parent", "ancestors": []}
+
+    async def insert_many(docs, ordered, session):
+      calls["docs"].append(docs)
+      if len(calls["docs"]) == 1:
+        raise BulkWriteError({"writeErrors": [{"index": 1, "code": 11000, "errmsg": "E11000 duplicate key"}]})
+
+    async def update_one(query, update, session):
+      calls["update"] = update
+
+    section = Section(path = "/", name = "root", items = [])
+    section._table = Mock(find = lambda query, projection, session: Cursor(), find_one = find_one, insert_many = insert_many, update_one = update_one)
+    section._table.database.client.start_session = start_session
+    section._id = "root"
+    MongoBase._materialized = True
+    try:
+      result = get_event_loop().run_until_complete(section.create_children([Item(name = "a"), Item(name = "b"), Item(name = "c")], as_ = "items"))
+    finally:
+      MongoBase._materialized = False
+
+    assert [child.slug for child in result["created"]] == ["a", "c"]
+    assert result["errors"] == [{"index": 1, "slug": "b", "error": "Already exists"}]
+    assert [doc["slug"] for doc in calls["docs"][1]] == ["a", "c"]
+    assert calls["update"] == {"$push": {"items": {"$each": ["a", "c"]}}}
+    assert calls["lineage"] == 1
+    assert all(doc["ancestors"] == ["root_parent", "root"] and doc["depth"] == 2 for doc in calls["docs"][1])
+
+  def test_create_children_enlists_in_the_unit_of_work(self):
+    calls = []
+    class Session:
+      async def __aenter__(self):
+        return self
+
+      async def __aexit__(self, *args):
+        pass
+
+      def start_transaction(self):
+        return self
+
+    async def start_session():
+      return Session()
+
+    class Cursor:
+      async def __aiter__(self):
+        yield {"slug": "taken"}
+
+    async def bulk_write(actions, session = None):
+      calls.append(actions)
+
+    table = Mock(find = lambda query, projection: Cursor(), bulk_write = bulk_write)
+    table.database.client.start_session = start_session
+    section = Section(path = "/", name = "root", items = [])
+    section._table = table
+
+    async def run():
+      async with table_uow(table):
+        result = await section.create_children([Item(name = "a"), Item(name = "taken")], as_ = "items")
+        assert calls == [] and section.items == []
+      return result
+
+    result = get_event_loop().run_until_complete(run())
+    assert [child.slug for child in result["created"]] == ["a"]
+    assert [error["index"] for error in result["errors"]] == [1]
+    assert len(calls) == 1 and [type(action) for action in calls[0]] == [InsertOne, UpdateOne]
+    assert section.items == ["a"] and result["created"][0]._dirty == set()
+
+  def test_unit_of_work_single_bulk_write(self):
+    calls = []
+    class Session:
+      async def __aenter__(self):
+        return self
+
+      async def __aexit__(self, *args):
+        pass
+
+      def start_transaction(self):
+        calls.append("transaction")
+        return self
+
+    async def start_session():
+      return Session()
+
+    async def bulk_write(actions, session = None):
+      calls.append(actions)
+
+    table = Mock(bulk_write = bulk_write)
+    table.database.client.start_session = start_session
+    section = Section(path = "/", name = "root")
+    section._table = table
+    get_event_loop().run_until_complete(section.create())
+    assert calls == [[InsertOne(section._to_doc())]]
+
+    calls.clear()
+    async def create_child():
+      async with table_uow(table):
+        await section.create_child(Item(name = "a"), None, as_ = "items")
+        assert calls == []
+
+    get_event_loop().run_until_complete(create_child())
+    assert calls[0] == "transaction"
+    assert [type(action) for action in calls[1]] == [InsertOne, UpdateOne]
+
+  def test_save_sends_delta(self):
+    updates = []
+    async def bulk_write(actions, session = None):
+      updates.extend(action._doc for action in actions)
+
+    folder = Folder._from_doc({"path": "/", "slug": "f", "type": "Folder", "name": "f", "items": ["a", "b"], "others": ["c"]}, Mock(bulk_write = bulk_write))
+    folder.add_to_set("items", "b", "d")
+    folder.pull("others", "c")
+    folder.type = None
+    get_event_loop().run_until_complete(folder.save())
+
+    assert folder.items == ["a", "b", "d"]
+    assert updates == [{"$unset": {"type": ""}, "$addToSet": {"items": {"$each": ["b", "d"]}}, "$pull": {"others": {"$in": ["c"]}}}]
+
+    updates.clear()
+    get_event_loop().run_until_complete(folder.save())
+    assert updates == []
+
+  def test_rename_and_delete_update_the_parent_atomically(self):
+    writes = []
+    class Cursor:
+      def sort(self, sort):
+        return self
+
+      async def __aiter__(self):
+        yield {"_id": "folder", "path": "/", "slug": "root", "type": "Folder", "name": "root", "items": ["a", "other"], "others": []}
+
+    async def bulk_write(actions, session = None):
+      writes.append([(action._filter, getattr(action, "_doc", None)) for action in actions])
+      return Mock(modified_count = 7)
+
+    class Session:
+      async def __aenter__(self):
+        return self
+
+      async def __aexit__(self, *args):
+        pass
+
+      def start_transaction(self):
+        return self
+
+    async def start_session():
+      return Session()
+
+    table = Mock(find = lambda query: Cursor(), bulk_write = bulk_write)
+    table.database.client.start_session = start_session
+    models = ModuleType("models")
+    models.Folder, models.Item = Folder, Item
+    item = Item._from_doc({"_id": "item", "path": "/root", "slug": "a", "type": "Item", "name": "a"}, table)
+    item.name = "b"
+
+    assert get_event_loop().run_until_complete(item.save(models)) == 7
+    assert ({"_id": "folder", "items": "a"}, {"$set": {"items.$": "b"}}) in writes[0]
+    assert ({"_id": "folder", "others": "a"}, {"$set": {"others.$": "b"}}) in writes[0]
+
+    get_event_loop().run_until_complete(item.delete(models))
+    assert writes[1][-1] == ({"_id": "folder"}, {"$pull": {"items": "b", "others": "b"}})
+
+  def test_save_keeps_tracking_when_the_write_fails(self):
+    updates = []
+    async def bulk_write(actions, session = None):
+      if not updates:
+        updates.append(None)
+        raise OSError("connection lost")
+      updates.extend(action._doc for action in actions)
+
+    folder = Folder._from_doc({"path": "/", "slug": "f", "type": "Folder", "name": "f", "items": ["a"], "others": []}, Mock(bulk_write = bulk_write))
+    folder.push("items", "b")
+    with pytest.raises(OSError):
+      get_event_loop().run_until_complete(folder.save())
+
+    get_event_loop().run_until_complete(folder.save())
+    assert updates[1:] == [{"$push": {"items": {"$each": ["b"]}}}]
+    assert folder._list_ops == {} and folder._dirty == set()
@@ -0,0 +1,83 @@
+from asyncio import get_event_loop, sleep
+from dataclasses import dataclass
+from datetime import timedelta
+
+from bson import ObjectId
+
+from yrest.tree import Tree
+from yrest.mongo import Mongo
+from yrest.notify import Notifier, encode_kwargs, OUTBOX
+
+@dataclass
+class Person(Tree, Mongo):
+  name: str = None
+
+class FakeTable:
+  def __init__(self):
+    self.docs = {}
+
+  async def insert_one(self, doc):
+    self.docs[doc["_id"]] = dict(doc)
+
+  async def delete_one(self, query):
+    self.docs.pop(query["_id"], None)
+
+  async def update_one(self, query, update):
+    self.docs[query["_id"]]["attempts"] += update["$inc"]["attempts"]
+
+  async def find_one_and_update(self, query, update, return_document):
+    for doc in self.docs.values():
+      if doc["attempts"] < query["attempts"]["$lt"] and doc["claimed_at"] < query["claimed_at"]["$lt"]:
+        doc.update(update["$set"])
+        return doc
+
+  async def find_one(self, query):
+    return {"_id": query["_id"], "path": "/", "slug": "ann", "type": "Person", "name": "Ann"}
+
+def run(coroutine):
+  return get_event_loop().run_until_complete(coroutine)
+
+class TestNotifier:
+  def test_dispatch_returns_before_running(self):
+    calls = []
+    async def notification(name, request, kwargs):
+      await sleep(0.01)
+      calls.append((name, kwargs))
+
+    notifier = Notifier(notification)
+    async def dispatch():
+      await notifier.dispatch("hello", None, {"a": 1})
+      assert calls == [] and notifier.pending == 1
+      await notifier.drain()
+
+    run(dispatch())
+    assert calls == [("hello", {"a": 1})]
+
+  def test_outbox_keeps_failures_and_replays(self):
+    table, calls = FakeTable(), []
+    async def notification(name, request, kwargs):
+      calls.append(kwargs)
+      if len(calls) == 1:
+        raise RuntimeError("SMTP is down")
+
+    notifier = Notifier(notification)
+    notifier.configure(table = table, lease = 60)
+    person = Person(name = "Ann", path = "/", _id = ObjectId())
+
+    async def first_run():
+      await notifier.dispatch("hello", None, {"actor": person, "code": 1})
+      await notifier.drain()
+
+    run(first_run())
+    entry, = table.docs.values()
+    assert entry["type"] == OUTBOX and entry["attempts"] == 1
+    assert entry["kwargs"] == encode_kwargs({"actor": person, "code": 1})
+
+    entry["claimed_at"] -= timedelta(seconds = 120)
+    async def replay():
+      assert await notifier.replay() == 1
+      await notifier.drain()
+
+    run(replay())
+    assert calls[1]["actor"].name == "Ann" and calls[1]["code"] == 1
+    assert table.docs == {}
@@ -0,0 +1,38 @@
+from gzip import decompress
+from json import loads
+from types import SimpleNamespace
+
+from yrest.openapi import OpenApi
+
+class Api(OpenApi):
+  def __init__(self):
+    self.builds = 0
+
+  def v3(self):
+    self.builds += 1
+    return {"openapi": "3.0.1", "paths": {}}
+
+class TestOpenApi:
+  def test_built_once(self):
+    api = Api()
+    first = api.openapi(SimpleNamespace(headers = {}))
+    api.openapi(SimpleNamespace(headers = {}))
+
+    assert api.builds == 1
+    assert loads(first.body) == {"openapi": "3.0.1", "paths": {}}
+
+    api.invalidate_openapi()
+    api.openapi(SimpleNamespace(headers = {}))
+    assert api.builds == 2
+
+  def test_etag_and_gzip(self):
+    api = Api()
+    plain = api.openapi(SimpleNamespace(headers = {}))
+    etag = plain.headers["ETag"]
+
+    gzipped = api.openapi(SimpleNamespace(headers = {"Accept-Encoding": "gzip, deflate"}))
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert decompress(gzipped.body) == plain.body
+
+    assert api.openapi(SimpleNamespace(headers = {"If-None-Match": f"W/{etag}"})).status == 304
+    assert api.openapi(SimpleNamespace(headers = {"If-None-Match": '"other"'})).status == 200
@@ -0,0 +1,48 @@
+from json import loads
+from typing import List, Dict, Any
+from dataclasses import dataclass, field
+from datetime import datetime
+from enum import Enum
+
+import pytest
+
+from bson import ObjectId, Decimal128
+
+from dataclasses_jsonschema import JsonSchemaMixin
+
+from yrest.tree import Tree
+from yrest.mongo import Mongo
+
+class Color(Enum):
+  RED = "red"
+
+@dataclass
+class Thing(JsonSchemaMixin, Tree, Mongo):
+  name: str = None
+  price: Decimal128 = None
+  when: datetime = None
+  color: Color = None
+  kids: List[ObjectId] = field(default_factory = list)
+  extra: Dict[str, Any] = None
+  secret: str = "secret"
+
+  __exclude__ = ["secret"]
+
+@pytest.fixture
+def thing():
+  return Thing(name = "A thing", price = Decimal128("1.5"), when = datetime(2019, 1, 1), color = Color.RED, kids = [ObjectId()], extra = {"a": 1}, _id = ObjectId())
+
+class TestSerializer:
+  @pytest.mark.filterwarnings("ignore:Naive datetime")
+  def test_matches_json_round_trip(self, thing):
+    expected = loads(thing.to_json(cls = thing._encoder.default))
+    expected.pop("secret")
+    assert thing.to_plain_dict() == expected
+
+  def test_omits_none(self):
+    assert "price" not in Thing(name = "A thing").to_plain_dict()
+
+  def test_untyped_values_become_wire_values(self):
+    _id = ObjectId()
+    thing = Thing(name = "A thing", extra = {"ref": _id, "refs": [_id], "price": Decimal128("2.5")})
+    assert thing.to_plain_dict()["extra"] == {"ref": str(_id), "refs": [str(_id)], "price": 2.5}
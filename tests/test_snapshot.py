@@ -0,0 +1,40 @@
+from types import ModuleType
+
+from yrest.snapshot import snapshot_key, load_snapshot, save_snapshot
+
+def make_models(tmp_path, source):
+  path = tmp_path / "models.py"
+  path.write_text(source)
+  models = ModuleType("models")
+  models.__file__ = str(path)
+  return models
+
+class TestSnapshot:
+  def test_key_follows_sources(self, tmp_path):
+    models = make_models(tmp_path, "class Root: pass\n")
+    key = snapshot_key(models, "Root")
+
+    assert key == snapshot_key(models, "Root")
+    assert key != snapshot_key(models, "Other")
+    (tmp_path / "models.py").write_text("class Root: name = None\n")
+    assert key != snapshot_key(models, "Root")
+
+  def test_key_follows_the_models_package(self, tmp_path):
+    package = tmp_path / "my_models"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "users.py").write_text("class User: pass\n")
+    models = ModuleType("my_models")
+    models.__file__, models.__path__ = str(package / "__init__.py"), [str(package)]
+    key = snapshot_key(models, "Root")
+
+    (package / "users.py").write_text("class User: name = None\n")
+    assert key != snapshot_key(models, "Root")
+
+  def test_round_trip(self, tmp_path):
+    path = str(tmp_path / "snapshot.pickle")
+    save_snapshot(path, {"key": "a", "introspection": {"Root": {"call": {"verb": "GET", "produces": dict}}}})
+
+    assert load_snapshot(path, "a")["introspection"]["Root"]["call"]["produces"] is dict
+    assert load_snapshot(path, "b") is None
+    assert load_snapshot(str(tmp_path / "missing.pickle"), "a") is None
@@ -0,0 +1,42 @@
+from types import ModuleType
+from typing import List
+from dataclasses import dataclass, field
+
+from bson import ObjectId
+
+from yrest.utils import mount_tree, get_model_lists
+
+@dataclass
+class Folder:
+  folders: List[str] = field(default_factory = list, metadata = {"model": "Folder"})
+  files: List[ObjectId] = field(default_factory = list, metadata = {"model": "File"})
+
+@dataclass
+class File:
+  name: str = None
+
+models = ModuleType("models")
+models.Folder, models.File = Folder, File
+
+class TestMountTree:
+  def test_get_model_lists(self):
+    assert get_model_lists(models, "Folder") == ["folders", "files"]
+    assert get_model_lists(models, "File") == []
+
+  def test_mount_tree(self):
+    file_id = ObjectId()
+    root = {"path": "", "slug": "root", "type": "Folder", "folders": ["a"], "files": []}
+    elements = [
+      {"path": "/a", "slug": "b", "type": "Folder", "folders": [], "files": [str(file_id)]},
+      {"_id": str(file_id), "path": "/a/b", "slug": "file", "type": "File"},
+      {"path": "/", "slug": "a", "type": "Folder", "folders": ["b", "missing"], "files": []}
+    ]
+
+    tree = mount_tree(elements, root, models)
+
+    a = tree["folders"][0]
+    assert tree["lists"] == ["folders", "files"]
+    assert a["slug"] == "a"
+    assert a["folders"][0]["slug"] == "b"
+    assert a["folders"][1] == "missing"
+    assert a["folders"][0]["files"][0]["slug"] == "file"
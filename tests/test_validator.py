@@ -0,0 +1,40 @@
+from typing import List
+from dataclasses import dataclass, field
+
+from dataclasses_jsonschema import JsonSchemaMixin
+
+from yrest.validator import validator
+
+@dataclass
+class Address(JsonSchemaMixin):
+  city: str
+
+@dataclass
+class Person(JsonSchemaMixin):
+  name: str
+  age: int = None
+  addresses: List[Address] = field(default_factory = list)
+
+@dataclass
+class Plain:
+  name: str
+
+class TestValidator:
+  def test_builds_valid_data(self):
+    person, errors = validator(Person)({"name": "Ann", "addresses": [{"city": "Oslo"}]})
+
+    assert errors == []
+    assert person == Person("Ann", addresses = [Address("Oslo")])
+
+  def test_field_errors(self):
+    person, errors = validator(Person)({"age": "old", "addresses": [{}]})
+
+    assert person is None
+    assert {error.field for error in errors} == {"name", "age", "addresses.0.city"}
+
+  def test_compiled_once(self):
+    assert validator(Person) is validator(Person)
+
+  def test_plain_classes(self):
+    assert validator(Plain)({"name": "Ann"}) == (Plain("Ann"), [])
+    assert validator(Plain)({"other": 1})[0] is None
@@ -2,8 +2,11 @@ from os import urandom
 from binascii import hexlify
 from hashlib import pbkdf2_hmac
 from secrets import compare_digest
+from asyncio import get_event_loop
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from time import perf_counter
 
-from typing import Any, List, Tuple, Dict, Union
+from typing import Any, Callable, List, Tuple, Dict, Union
 from datetime import datetime, timedelta
 from dataclasses import dataclass, field
 from uuid import UUID, uuid4
@@ -13,7 +16,7 @@ from bson import ObjectId
 import jwt
 
 from sanic.request import Request
-from sanic.exceptions import Unauthorized
+from sanic.exceptions import Unauthorized, ServiceUnavailable
 
 from dataclasses_jsonschema import JsonSchemaMixin, JsonSchemaMeta
 
@@ -32,6 +35,51 @@ def check_password_hash(hashed: str, password: str) -> bool:
   _, salt, _ = hashed.split("$")
   return compare_digest(generate_password_hash(password, salt), hashed)
 
+class PasswordHasher:
+  """Hashes and checks passwords in an executor so PBKDF2 doesn't block the event loop
+
+  At most workers + queue_size calls are pending, the ones beyond fail fast with ServiceUnavailable
+  """
+  def __init__(self, workers: int = 4, queue_size: int = 64, processes: bool = False):
+    self._executor: Executor = None
+    self.pending = 0
+    self.rejected = 0
+    self.configure(workers, queue_size, processes)
+
+  def configure(self, workers: int = 4, queue_size: int = 64, processes: bool = False):
+    self.shutdown()
+    self.workers, self.queue_size, self.processes = workers, queue_size, processes
+
+  def shutdown(self):
+    if self._executor is not None:
+      self._executor.shutdown(wait = False)
+      self._executor = None
+
+  @property
+  def executor(self) -> Executor:
+    if self._executor is None:
+      self._executor = (ProcessPoolExecutor if self.processes else ThreadPoolExecutor)(self.workers)
+    return self._executor
+
+  async def _run(self, func: Callable, *args: Any) -> Any:
+    if self.pending >= self.workers + self.queue_size:
+      self.rejected += 1
+      raise ServiceUnavailable("Too many password checks in progress, try again later")
+
+    self.pending += 1
+    try:
+      return await get_event_loop().run_in_executor(self.executor, func, *args)
+    finally:
+      self.pending -= 1
+
+  async def hash(self, password: str) -> str:
+    return await self._run(generate_password_hash, password)
+
+  async def check(self, hashed: str, password: str) -> bool:
+    return await self._run(check_password_hash, hashed, password)
+
+default_hasher = PasswordHasher()
+
 @dataclass
 class AuthToken(JsonSchemaMixin):
   access_token: str
@@ -53,10 +101,21 @@ class AuthToken(JsonSchemaMixin):
     except (jwt.DecodeError, jwt.ExpiredSignatureError):
       return False
 
-  async def get_actor(self, table, secret, user_class):
+  async def get_actor(self, table, secret, user_class, cache = None):
+    if cache is not None and self.access_token:
+      doc = cache.get(self.access_token)
+      if doc is not None:
+        return user_class._from_doc(doc, table)
+
     payload = self.verify(secret)
     if payload:
-      return await user_class.get(table, _id = ObjectId(payload["user_id"]))
+      doc = await user_class._get_doc(table, type = user_class.__name__, _id = ObjectId(payload["user_id"]))
+      if not doc:
+        return doc
+
+      if cache is not None:
+        cache.set(self.access_token, doc, payload.get("exp"))
+      return user_class._from_doc(doc, table)
 
 @dataclass
 class Auth(JsonSchemaMixin):
@@ -68,9 +127,14 @@ class Auth(JsonSchemaMixin):
   def secure(cls, password):
     return password if password.startswith('pbkdf2:sha256:') else generate_password_hash(password)
 
-  async def authorize(self, table, secret, user_class):
+  @classmethod
+  async def asecure(cls, password, hasher: PasswordHasher = None):
+    """Like secure but hashing in the hasher's executor"""
+    return password if password.startswith('pbkdf2:sha256:') else await (hasher or default_hasher).hash(password)
+
+  async def authorize(self, table, secret, user_class, hasher: PasswordHasher = None):
     user = await user_class.get(table, email = self.email)
-    if user and check_password_hash(user.password, self.password):
+    if user and await (hasher or default_hasher).check(user.password, self.password):
       return AuthToken.generate({"user_id": str(user._id)}, secret)
 
 @dataclass
@@ -102,7 +166,14 @@ class ResetPassword(JsonSchemaMixin):
 class IsAuth:
   async def auth(self, request: Request, consume: Auth) -> AuthToken:
     """Authorizes email and password"""
-    token = await consume.authorize(self._table, request.app.config["JWT_SECRET"], request.app._models.User)
+    start = perf_counter()
+    try:
+      token = await consume.authorize(self._table, request.app.config["JWT_SECRET"], request.app._models.User, request.app._hasher)
+    except ServiceUnavailable as e:
+      request.app._metrics.observe("yrest_login_seconds", perf_counter() - start, outcome = "rejected")
+      return ErrorMessage(message = e.args[0], code = 503)
+
+    request.app._metrics.observe("yrest_login_seconds", perf_counter() - start, outcome = "ok" if token else "failed")
     return token if token else ErrorMessage("The autentication has failed", 401)
 
   async def forgot_password(self, request: Request, consume: ForgotPasswordRequest) -> Ok:
@@ -121,7 +192,7 @@ class IsAuth:
     token._table = self._table
     await token.create()
 
-    await request.app.notify(request, 'forgot_password', actor = user, token = token)
+    await request.app.notify(request, 'forgot_password', background = True, actor = user, token = token)
 
   async def reset_password(self, request: Request, consume: ResetPassword) -> Ok:
     """Reset the password authenticating the actor the forgot password token"""
@@ -0,0 +1,136 @@
+from collections import OrderedDict
+from time import monotonic, time
+from typing import Any, Dict, Hashable
+
+from bson import encode, decode
+
+from yrest.mongo import Mongo, on_write
+
+MISSING = object()
+
+class Cache:
+  """A small in-process cache with optional LRU bound, TTL and hit/miss counters"""
+  def __init__(self, maxsize: int = None, ttl: float = None):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self._data = OrderedDict()
+
+  def __len__(self) -> int:
+    return len(self._data)
+
+  def __contains__(self, key: Hashable) -> bool:
+    return self.get(key, MISSING, count = False) is not MISSING
+
+  def get(self, key: Hashable, default: Any = None, count: bool = True) -> Any:
+    entry = self._data.get(key, MISSING)
+    if entry is not MISSING:
+      value, expires = entry
+      if expires is None or expires > monotonic():
+        self._data.move_to_end(key)
+        if count:
+          self.hits += 1
+        return value
+
+      del self._data[key]
+
+    if count:
+      self.misses += 1
+    return default
+
+  def set(self, key: Hashable, value: Any, expires: float = None):
+    if self.ttl is not None:
+      ttl_expires = monotonic() + self.ttl
+      expires = ttl_expires if expires is None else min(expires, ttl_expires)
+
+    self._data[key] = (value, expires)
+    self._data.move_to_end(key)
+    if self.maxsize is not None:
+      while len(self._data) > self.maxsize:
+        self._data.popitem(last = False)
+
+  def pop(self, key: Hashable, default: Any = None) -> Any:
+    entry = self._data.pop(key, MISSING)
+    return default if entry is MISSING else entry[0]
+
+  def clear(self):
+    self._data.clear()
+
+  def stats(self) -> Dict[str, int]:
+    return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+class PermissionCache:
+  """Keeps the Permission documents in memory keyed by (context, name)
+
+  The cache is emptied whenever a Permission is created, updated or deleted through MongoBase
+  Entries expire after ttl seconds so the changes made by other workers are eventually seen
+  """
+  def __init__(self, model: Mongo, ttl: float = 60):
+    self._model = model
+    self._cache = Cache(ttl = ttl)
+    on_write(model.__name__, self.invalidate)
+
+  def configure(self, ttl: float = None):
+    self._cache.ttl = ttl
+
+  async def load(self, table):
+    self._cache.clear()
+    for perm in await self._model.gets(table):
+      self._cache.set((perm.context, perm.name), perm)
+
+  async def get(self, table, context: str, name: str) -> Mongo:
+    key = (context, name)
+    perm = self._cache.get(key, MISSING)
+    if perm is MISSING:
+      perm = await self._model.get(table, context = context, name = name)
+      self._cache.set(key, perm)
+
+    return perm
+
+  def invalidate(self, obj: Mongo = None, action: str = None):
+    self._cache.clear()
+
+  def stats(self) -> Dict[str, int]:
+    return self._cache.stats()
+
+class ActorCache:
+  """Maps verified access tokens to their actors' documents
+
+  Documents are kept as BSON so every get returns a fresh copy to hydrate, requests never share an actor
+  An entry never outlives its token's exp and is evicted when the actor's document is updated or deleted through MongoBase
+  """
+  def __init__(self, model: Mongo, maxsize: int = 1024, ttl: float = 60):
+    self._cache = Cache(maxsize, ttl)
+    self._tokens = {}
+    on_write(model.__name__, self.invalidate)
+
+  def configure(self, maxsize: int = None, ttl: float = None):
+    self._cache.maxsize = maxsize
+    self._cache.ttl = ttl
+
+  def get(self, token: str) -> Dict[str, Any]:
+    raw = self._cache.get(token)
+    return None if raw is None else decode(raw)
+
+  def set(self, token: str, doc: Dict[str, Any], exp: float = None):
+    self._cache.set(token, encode(doc), None if exp is None else monotonic() + exp - time())
+    self._tokens.setdefault(doc["_id"], set()).add(token)
+
+    if self._cache.maxsize is not None and len(self._tokens) > self._cache.maxsize:
+      self._prune()
+
+  def _prune(self):
+    tokens = {}
+    for _id, actor_tokens in self._tokens.items():
+      alive = {token for token in actor_tokens if token in self._cache}
+      if alive:
+        tokens[_id] = alive
+    self._tokens = tokens
+
+  def invalidate(self, obj: Mongo, action: str = None):
+    for token in self._tokens.pop(obj._id, ()):
+      self._cache.pop(token)
+
+  def stats(self) -> Dict[str, int]:
+    return self._cache.stats()
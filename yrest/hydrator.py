@@ -0,0 +1,52 @@
+from typing import Any, Callable, Dict
+from dataclasses import fields, MISSING
+
+from slugify import slugify
+
+from yrest.tree import TreeBase
+
+_hydrators: Dict[type, Callable[[Dict[str, Any]], Any]] = {}
+_NOT_FOUND = object()
+
+def _compile(cls: type) -> Callable[[Dict[str, Any]], Any]:
+  """Generates a function that builds a cls instance from a trusted document without running __init__
+
+  Unknown keys are ignored and missing fields take their defaults
+  Models that define their own __post_init__ are built with cls(**known_fields) so it still runs
+  """
+  post_init = getattr(cls, "__post_init__", None)
+  if post_init is not None and post_init is not TreeBase.__post_init__:
+    known = frozenset(field.name for field in fields(cls))
+    return lambda doc: cls(**{key: value for key, value in doc.items() if key in known})
+
+  namespace = {"cls": cls, "new": object.__new__, "slugify": slugify, "NOT_FOUND": _NOT_FOUND}
+  lines = ["def hydrate(doc):", "  obj = new(cls)", "  attrs = obj.__dict__", "  get = doc.get"]
+  for idx, field in enumerate(fields(cls)):
+    if field.default is not MISSING:
+      namespace[f"default_{idx}"] = field.default
+      lines.append(f"  attrs[{field.name!r}] = get({field.name!r}, default_{idx})")
+    elif field.default_factory is not MISSING:
+      namespace[f"factory_{idx}"] = field.default_factory
+      lines.append(f"  value = get({field.name!r}, NOT_FOUND)")
+      lines.append(f"  attrs[{field.name!r}] = factory_{idx}() if value is NOT_FOUND else value")
+    else:
+      lines.append(f"  attrs[{field.name!r}] = doc[{field.name!r}]")
+
+  if post_init is not None:
+    # What TreeBase.__post_init__ does, only when the document lacks the values
+    lines.append("  if attrs['type'] is None:")
+    lines.append("    attrs['type'] = cls.__name__")
+    lines.append("  if attrs['slug'] is None:")
+    lines.append("    attrs['slug'] = slugify(obj.__sluger__())")
+  lines.append("  return obj")
+
+  exec("\n".join(lines), namespace)
+  return namespace["hydrate"]
+
+def hydrator(cls: type) -> Callable[[Dict[str, Any]], Any]:
+  """Returns the hydrator of a dataclass, compiling it the first time"""
+  try:
+    return _hydrators[cls]
+  except KeyError:
+    _hydrators[cls] = _compile(cls)
+    return _hydrators[cls]
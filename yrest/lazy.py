@@ -0,0 +1,76 @@
+from dataclasses import MISSING
+from inspect import getattr_static
+from typing import Any, Dict
+
+from bson import decode
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+from yrest.serializer import register_wire_types, serializer, to_wire
+
+RAW_OPTIONS = CodecOptions(document_class = RawBSONDocument)
+
+register_wire_types({RawBSONDocument: lambda doc: to_wire(decode(doc.raw))})
+
+def _plain(value: Any) -> Any:
+  """Decodes the raw sub-documents of a field value into dicts"""
+  if isinstance(value, RawBSONDocument):
+    return decode(value.raw)
+  elif isinstance(value, list):
+    return [_plain(item) for item in value]
+  return value
+
+def raw_table(table: Any) -> Any:
+  """Returns the same collection but reading RawBSONDocuments instead of decoded dicts"""
+  return table.with_options(codec_options = RAW_OPTIONS)
+
+class LazyView:
+  """Read-only view of a model over a RawBSONDocument
+
+  The document is decoded on the first field read and the model's __init__/__post_init__ never run
+  The model's methods and properties work on the view as long as they don't assign attributes
+  """
+  __slots__ = ("_doc", "_model", "_table")
+
+  def __init__(self, model: type, doc: RawBSONDocument, table: Any = None):
+    object.__setattr__(self, "_doc", doc)
+    object.__setattr__(self, "_model", model)
+    object.__setattr__(self, "_table", table)
+
+  def __getattr__(self, name: str) -> Any:
+    field = self._model.__dataclass_fields__.get(name)
+    if field is not None:
+      try:
+        return _plain(self._doc[name])
+      except KeyError:
+        if field.default is not MISSING:
+          return field.default
+        elif field.default_factory is not MISSING:
+          return field.default_factory()
+        raise AttributeError(name)
+    elif name in ("_ancestors", "_depth"):
+      return self._doc.get(name[1:])
+
+    attr = getattr_static(self._model, name)
+    return attr.__get__(self, self._model) if hasattr(attr, "__get__") else attr
+
+  def __setattr__(self, name: str, value: Any):
+    raise AttributeError(f"{self._model.__name__} views are read-only, hydrate it to modify it")
+
+  def __repr__(self) -> str:
+    return f"{self._model.__name__}View(_id={self._doc.get('_id')!r})"
+
+  @property
+  def raw(self) -> bytes:
+    """The undecoded BSON of the document"""
+    return self._doc.raw
+
+  def hydrate(self) -> Any:
+    """Returns the full model instance"""
+    return self._model._from_doc(decode(self._doc.raw), self._table)
+
+  def to_plain_dict(self) -> Dict[str, Any]:
+    # The raw bytes are decoded in one pass and the fields serialized from the resulting dict
+    if isinstance(self._doc, RawBSONDocument):
+      return serializer(self._model)(LazyView(self._model, decode(self._doc.raw), self._table))
+    return serializer(self._model)(self)
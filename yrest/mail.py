@@ -0,0 +1,253 @@
+from asyncio import Queue, QueueFull, Semaphore, CancelledError, get_event_loop, gather, sleep, wait_for
+from email.encoders import encode_base64
+from email.message import Message
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from mimetypes import guess_type
+from os.path import isfile
+from typing import Any, Dict, List, Tuple
+
+from aiosmtplib import SMTP, SMTPException
+
+from sanic.log import logger
+
+def _read_attachment(path: str) -> Tuple[str, bytes]:
+  if not isfile(path):
+    return path, None
+
+  with open(path, "rb") as f:
+    return path, f.read()
+
+async def build_message(from_: str, to: str, subject: str, text: str = None, html: str = None, attachments: List[str] = None) -> Message:
+  """Builds the MIME message reading the attachments in the default executor"""
+  if text is None and html is None:
+    raise ValueError("Neither text nor html has been provided")
+  elif text is not None and html is not None:
+    message = MIMEMultipart("alternative")
+    message.attach(MIMEText(text))
+    message.attach(MIMEText(html, "html"))
+  elif html is not None and attachments:
+    message = MIMEMultipart()
+    message.attach(MIMEText(html, "html"))
+  elif text is None:
+    message = MIMEText(html, "html")
+  else:
+    message = MIMEText(text)
+
+  if attachments:
+    loop = get_event_loop()
+    files = await gather(*[loop.run_in_executor(None, _read_attachment, attachment) for attachment in attachments])
+    for idx, (attachment, content) in enumerate(files):
+      if content is None:
+        logger.warning(f"{attachment} is not a file")
+        continue
+
+      main_type, subtype = (guess_type(attachment)[0] or "application/octet-stream").split("/", 1)
+      attach = MIMEBase(main_type, subtype)
+      attach.set_payload(content)
+      encode_base64(attach)
+      attach.add_header("Content-Disposition", "attachment", filename = attachment)
+      attach.add_header("X-Attachment-Id", str(idx))
+      attach.add_header("Content-ID", f"<{idx}>")
+      message.attach(attach)
+
+  message["From"] = from_
+  message["To"] = to
+  message["Subject"] = subject
+
+  return message
+
+class DeliveryHandle:
+  """Tracks a queued message. Await it to get the server's response or the error of the last attempt"""
+  def __init__(self, message: Message):
+    self.message = message
+    self.attempts = 0
+    self._future = get_event_loop().create_future()
+    self._future.add_done_callback(self._log)
+
+  def _log(self, future):
+    # Retrieving the exception here also keeps asyncio from warning about handles nobody awaits
+    if not future.cancelled() and future.exception() is not None:
+      logger.error(f"Mail to {self.message['To']} failed after {self.attempts} attempts: {future.exception()}")
+
+  def __await__(self):
+    return self._future.__await__()
+
+  @property
+  def status(self) -> str:
+    if not self._future.done():
+      return "queued"
+    return "failed" if self._future.exception() is not None else "sent"
+
+  def done(self) -> bool:
+    return self._future.done()
+
+  def _resolve(self, result: Any = None, error: Exception = None):
+    if self._future.done():
+      return
+    if error is None:
+      self._future.set_result(result)
+    else:
+      self._future.set_exception(error)
+
+class SMTPPool:
+  """At most size persistent SMTP connections, reconnected when the server drops them"""
+  def __init__(self, hostname: str, port: int, size: int = 2, connection_class: type = SMTP, **kwargs: Any):
+    self.hostname, self.port, self.kwargs = hostname, port, kwargs
+    self.connection_class = connection_class
+    self._slots = Semaphore(size)
+    self._idle: List[Any] = []
+
+  async def acquire(self) -> Any:
+    await self._slots.acquire()
+    try:
+      while self._idle:
+        connection = self._idle.pop()
+        if connection.is_connected:
+          return connection
+
+      connection = self.connection_class(hostname = self.hostname, port = self.port, **self.kwargs)
+      await connection.connect()
+      return connection
+    except BaseException:
+      self._slots.release()
+      raise
+
+  async def release(self, connection: Any, broken: bool = False):
+    if broken:
+      connection.close()
+    else:
+      self._idle.append(connection)
+    self._slots.release()
+
+  async def close(self):
+    idle, self._idle = self._idle, []
+    for connection in idle:
+      try:
+        await connection.quit()
+      except (SMTPException, OSError):
+        connection.close()
+
+class Mailer:
+  """Delivers messages from a bounded queue with worker tasks sharing an SMTP pool
+
+  Each worker takes up to batch_size messages and sends them through one connection
+  Failed messages are retried up to retries times waiting backoff * 2 ** attempt seconds
+  """
+  def __init__(self, hostname: str, port: int, pool_size: int = 2, workers: int = 2, queue_size: int = 1000, batch_size: int = 10, retries: int = 3, backoff: float = 1, connection_class: type = SMTP, **smtp_args: Any):
+    self.pool = SMTPPool(hostname, port, pool_size, connection_class, **smtp_args)
+    self.queue: Queue = Queue(queue_size)
+    self.workers, self.batch_size, self.retries, self.backoff = workers, batch_size, retries, backoff
+    self._tasks = []
+    self._retrying = set()
+
+  @classmethod
+  def from_config(cls, config: Dict[str, Any]) -> 'Mailer':
+    return cls(
+      config["MAIL_SERVER"],
+      config["MAIL_PORT"],
+      pool_size = config.get("MAIL_POOL_SIZE", 2),
+      workers = config.get("MAIL_WORKERS", 2),
+      queue_size = config.get("MAIL_QUEUE_SIZE", 1000),
+      batch_size = config.get("MAIL_BATCH_SIZE", 10),
+      retries = config.get("MAIL_RETRIES", 3),
+      backoff = config.get("MAIL_BACKOFF", 1),
+      **config.get("MAIL_ARGS", {})
+    )
+
+  def start(self):
+    if not self._tasks:
+      loop = get_event_loop()
+      self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+  async def stop(self, timeout: float = None):
+    """Waits (up to timeout seconds) for the queued and retrying messages, then stops the workers"""
+    try:
+      await wait_for(self._drain(), timeout)
+    finally:
+      for task in self._tasks:
+        task.cancel()
+      await gather(*self._tasks, return_exceptions = True)
+      self._tasks = []
+      await self.pool.close()
+
+  async def _drain(self):
+    while True:
+      await self.queue.join()
+      if not self._retrying:
+        return
+      await gather(*self._retrying)
+
+  def enqueue(self, message: Message) -> DeliveryHandle:
+    """Queues message and returns its handle. Raises QueueFull when the queue is"""
+    handle = DeliveryHandle(message)
+    self.queue.put_nowait(handle)
+    self.start()
+    return handle
+
+  async def _work(self):
+    while True:
+      batch = [await self.queue.get()]
+      while len(batch) < self.batch_size and not self.queue.empty():
+        batch.append(self.queue.get_nowait())
+
+      try:
+        await self._send([handle for handle in batch if not handle.done()])
+      except CancelledError:
+        raise
+      except Exception as e:
+        for handle in batch:
+          handle._resolve(error = e)
+      finally:
+        for _ in batch:
+          self.queue.task_done()
+
+  async def _send(self, batch: List[DeliveryHandle]):
+    if not batch:
+      return
+
+    for handle in batch:
+      handle.attempts += 1
+
+    try:
+      connection = await self.pool.acquire()
+    except (SMTPException, OSError) as e:
+      for handle in batch:
+        self._retry(handle, e)
+      return
+
+    error = None
+    try:
+      for handle in batch:
+        if error is not None and not connection.is_connected:
+          # The server dropped the connection, the rest of the batch waits for another one
+          self._retry(handle, error)
+          continue
+
+        try:
+          handle._resolve(await connection.send_message(handle.message))
+        except (SMTPException, OSError) as e:
+          error = e
+          self._retry(handle, e)
+    finally:
+      await self.pool.release(connection, error is not None and not connection.is_connected)
+
+  def _retry(self, handle: DeliveryHandle, error: Exception):
+    if handle.attempts >= self.retries:
+      handle._resolve(error = error)
+      return
+
+    task = get_event_loop().create_task(self._requeue(handle, self.backoff * 2 ** (handle.attempts - 1)))
+    self._retrying.add(task)
+    task.add_done_callback(self._retrying.discard)
+
+  async def _requeue(self, handle: DeliveryHandle, delay: float):
+    await sleep(delay)
+    if handle.done():
+      return
+
+    try:
+      self.queue.put_nowait(handle)
+    except QueueFull as e:
+      handle._resolve(error = e)
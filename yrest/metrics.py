@@ -0,0 +1,100 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, Iterator, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Histogram:
+  """A cumulative latency histogram in the Prometheus sense"""
+  def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+    self.buckets = buckets
+    self.counts = [0] * len(buckets)
+    self.count = 0
+    self.sum = 0.0
+
+  def observe(self, value: float):
+    idx = bisect_left(self.buckets, value)
+    if idx < len(self.counts):
+      self.counts[idx] += 1
+    self.count += 1
+    self.sum += value
+
+  def quantile(self, q: float) -> float:
+    """Estimates the q quantile as the upper bound of the bucket that holds it"""
+    target, seen = q * self.count, 0
+    for bound, count in zip(self.buckets, self.counts):
+      seen += count
+      if seen >= target and seen:
+        return bound
+    return float("inf")
+
+class Metrics:
+  """In-process registry of labelled histograms and counters rendered in Prometheus text format"""
+  def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+    self.buckets = buckets
+    self._histograms: Dict[str, Dict[Tuple, Histogram]] = {}
+    self._help: Dict[str, str] = {}
+
+  def describe(self, name: str, help: str):
+    self._help[name] = help
+
+  def histogram(self, name: str, **labels: str) -> Histogram:
+    series = self._histograms.setdefault(name, {})
+    key = tuple(sorted(labels.items()))
+    if key not in series:
+      series[key] = Histogram(self.buckets)
+    return series[key]
+
+  def observe(self, name: str, value: float, **labels: str):
+    self.histogram(name, **labels).observe(value)
+
+  def render(self, counters: Dict[str, Dict[Tuple, float]] = None) -> str:
+    lines = []
+    for name, series in self._histograms.items():
+      if name in self._help:
+        lines.append(f"# HELP {name} {self._help[name]}")
+      lines.append(f"# TYPE {name} histogram")
+      for labels, histogram in series.items():
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+          cumulative += count
+          lines.append(f"{name}_bucket{_labels(labels + (('le', repr(float(bound))),))} {cumulative}")
+        lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+    for name, series in (counters or {}).items():
+      lines.append(f"# TYPE {name} counter")
+      for labels, value in series.items():
+        lines.append(f"{name}{_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
+
+def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+  if not labels:
+    return ""
+  return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+def _escape(value: str) -> str:
+  return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Stopwatch:
+  """Collects the time spent on each stage of a request"""
+  def __init__(self):
+    self.member = None
+    self.stages: Dict[str, float] = {}
+
+  @contextmanager
+  def stage(self, name: str) -> Iterator[None]:
+    start = perf_counter()
+    try:
+      yield
+    finally:
+      self.add(name, perf_counter() - start)
+
+  def add(self, name: str, seconds: float):
+    self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+  def server_timing(self) -> str:
+    return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.stages.items())
@@ -0,0 +1,52 @@
+"""Backfills the materialized ancestors and depth of an existing collection
+
+  python -m yrest.migrate mongodb://localhost:27017 my_db [my_table]
+"""
+from argparse import ArgumentParser
+from asyncio import get_event_loop
+from typing import Any, Dict, List
+
+from pymongo import ASCENDING, UpdateOne
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+
+from yrest.utils import get_url
+
+async def backfill_ancestors(table: AsyncIOMotorCollection, batch_size: int = 1000) -> int:
+  """Sets ancestors and depth on every document of table and returns how many were updated
+
+  Documents are read sorted by path so every parent is seen before its children
+  """
+  lineages: Dict[str, List[Any]] = {}
+  actions, updated = [], 0
+
+  async for doc in table.find({}, {"path": 1, "slug": 1}).sort("path", ASCENDING):
+    ancestors = lineages.get(doc["path"], []) if doc["path"] else []
+    lineages[get_url(doc["path"], doc.get("slug"))] = ancestors + [doc["_id"]]
+
+    actions.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"ancestors": ancestors, "depth": len(ancestors)}}))
+    if len(actions) >= batch_size:
+      updated += (await table.bulk_write(actions, ordered = False)).modified_count
+      actions = []
+
+  if actions:
+    updated += (await table.bulk_write(actions, ordered = False)).modified_count
+
+  await table.create_index([("ancestors", ASCENDING), ("depth", ASCENDING)])
+
+  return updated
+
+def main():
+  parser = ArgumentParser(description = "Backfills the materialized ancestors and depth of a yRest collection")
+  parser.add_argument("uri", help = "The MongoDB URI")
+  parser.add_argument("db", help = "The database name")
+  parser.add_argument("table", nargs = "?", help = "The collection name (defaults to the database name)")
+  parser.add_argument("--batch-size", type = int, default = 1000)
+  args = parser.parse_args()
+
+  client = AsyncIOMotorClient(args.uri)
+  table = client[args.db][args.table or args.db]
+  updated = get_event_loop().run_until_complete(backfill_ancestors(table, args.batch_size))
+  print(f"{updated} documents updated")
+
+if __name__ == "__main__":
+  main()
@@ -1,22 +1,29 @@
 from types import ModuleType
-from typing import Any, List, Dict, Union
+from typing import Any, List, Dict, Set, Tuple, Union, Callable, Awaitable, AsyncIterator
 from inspect import getmembers, isclass
 from pathlib import PurePath
 from json import JSONEncoder
 from decimal import Decimal
 from dataclasses import dataclass, fields, field, asdict
 from enum import Enum
+from asyncio import gather
+from re import escape
+from contextvars import ContextVar
 
 from bson import ObjectId, Decimal128
-from pymongo import UpdateOne, DeleteOne, DeleteMany
+from pymongo import InsertOne, UpdateOne, UpdateMany, DeleteOne, DeleteMany, ReplaceOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 from motor.motor_asyncio import AsyncIOMotorCollection
 
 from slugify import slugify
 
-from dataclasses_jsonschema import JsonSchemaMixin, FieldEncoder
+from dataclasses_jsonschema import JsonSchemaMixin, FieldEncoder, ValidationError
 
 from yrest.tree import Tree
-from yrest.utils import get_url
+from yrest.utils import get_url, mount_tree
+from yrest.serializer import register_wire_types
+from yrest.lazy import LazyView, raw_table
+from yrest.hydrator import hydrator
 
 class ChildrenAbiguity(Exception):
   pass
@@ -54,12 +61,205 @@ class MongoJSONEncoder(JSONEncoder):
       return float(obj)
     elif isinstance(obj, Decimal128):
       return float(obj.to_decimal())
+    elif isinstance(obj, LazyView):
+      # Views placed in untyped fields, like the result of the response envelopes
+      return obj.to_plain_dict()
     else:
       return JSONEncoder.default(self, obj)
 
+register_wire_types({ObjectId: str, Decimal128: lambda value: float(value.to_decimal()), Decimal: float}, MongoJSONEncoder)
+register_wire_types({LazyView: lambda view: view.to_plain_dict()})
+
+# Stages that can't be used inside a $facet
+FACET_FORBIDDEN = {"$out", "$merge", "$facet", "$collStats", "$indexStats", "$geoNear", "$search", "$searchMeta"}
+# Errors raised when the single $facet document would exceed the 16MB BSON limit (BSONObjectTooLarge and the pre 3.6 one)
+DOCUMENT_TOO_LARGE = {10334, 16389}
+
+_write_listeners: Dict[str, List[Callable]] = {}
+_registries: Dict[ModuleType, Dict[str, 'Mongo']] = {}
+
+def on_write(model: str, callback: Callable[['Mongo', str], Any]):
+  """Registers a callback to be called with (obj, action) after a model's document is created, updated or deleted"""
+  _write_listeners.setdefault(model, []).append(callback)
+
+def model_registry(models: ModuleType) -> Dict[str, 'Mongo']:
+  """Returns the Mongo models defined in a models module, built once per module"""
+  if models not in _registries:
+    _registries[models] = {name: model for name, model in getmembers(models, lambda m: isclass(m) and issubclass(m, Mongo))}
+  return _registries[models]
+
+# Operations that touch a single document
+SINGLE_DOCUMENT = (InsertOne, UpdateOne, DeleteOne, ReplaceOne)
+
+_current_uow: ContextVar = ContextVar("yrest_uow", default = None)
+
+class UnitOfWork:
+  """Collects the writes done through MongoBase on a table and flushes them in one bulk_write
+
+  The flush runs inside a transaction unless it's just one operation on one document
+  Write listeners and done callbacks are called once the flush succeeds, nothing is written if the block raises
+  """
+  def __init__(self, table: AsyncIOMotorCollection):
+    self.table = table
+    self.actions = []
+    self.written = []
+    self.result = None
+    self._depth = 0
+    self._token = None
+
+  def add(self, actions: List[Any], obj: 'Mongo' = None, action: str = None, done: Callable[[], Any] = None):
+    self.actions.extend(actions)
+    if obj is not None or done is not None:
+      self.written.append((obj, action, done))
+
+  async def flush(self):
+    actions, written = self.actions, self.written
+    self.actions, self.written = [], []
+    if not actions:
+      return
+
+    try:
+      if len(actions) == 1 and isinstance(actions[0], SINGLE_DOCUMENT):
+        self.result = await self.table.bulk_write(actions)
+      else:
+        async with await self.table.database.client.start_session() as s:
+          async with s.start_transaction():
+            self.result = await self.table.bulk_write(actions, session = s)
+    except BulkWriteError as e:
+      duplicated = [error for error in e.details.get("writeErrors", []) if error.get("code") == 11000]
+      if duplicated:
+        raise DuplicateKeyError(duplicated[0].get("errmsg", "Duplicate key"), 11000, duplicated[0]) from e
+      raise
+
+    for obj, action, done in written:
+      if obj is not None:
+        obj._written(action)
+      if done is not None:
+        done()
+
+  async def __aenter__(self) -> 'UnitOfWork':
+    if self._depth == 0:
+      self._token = _current_uow.set(self)
+    self._depth += 1
+    return self
+
+  async def __aexit__(self, exc_type, exc, tb):
+    self._depth -= 1
+    if self._depth:
+      return
+
+    _current_uow.reset(self._token)
+    if exc_type is None:
+      await self.flush()
+    else:
+      self.actions, self.written = [], []
+
+def table_uow(table: AsyncIOMotorCollection) -> UnitOfWork:
+  """Returns the unit of work to use as `async with table_uow(table) as uow:`, joining the current one if it's on the same table"""
+  current = _current_uow.get()
+  return current if current is not None and current.table is table else UnitOfWork(table)
+
 class MongoBase:
   _table: AsyncIOMotorCollection = field(default = None, repr = False, compare = False, hash = False)
   _encoder: JSONEncoder = field(default = MongoJSONEncoder, init = False, repr = False, compare = False, hash = False)
+  # When enabled every document stores the _ids of its ancestors (root first) and its depth
+  _materialized = False
+  _ancestors: List[ObjectId] = None
+  _depth: int = None
+  # Fields assigned and atomic list operations queued since hydration, creation or the last save (None while not tracking)
+  _dirty: Set[str] = None
+  _list_ops: Dict[str, Tuple[str, List[Any]]] = None
+
+  def __setattr__(self, name: str, value: Any):
+    if self._dirty is not None and name != "_id" and name in self.__dataclass_fields__:
+      self._dirty.add(name)
+    object.__setattr__(self, name, value)
+
+  def _track(self):
+    object.__setattr__(self, "_dirty", set())
+    object.__setattr__(self, "_list_ops", {})
+
+  def _queue(self, op: str, name: str, values: List[Any]):
+    if self._dirty is None:
+      return
+
+    queued = self._list_ops.get(name)
+    if queued is None:
+      self._list_ops[name] = (op, list(values))
+    elif queued[0] == op:
+      queued[1].extend(values)
+    else:
+      # Mongo can't apply two different operators to the same path in one update, so the whole list is $set
+      del self._list_ops[name]
+      self._dirty.add(name)
+
+  def add_to_set(self, name: str, *values: Any):
+    """Adds the missing values to a list field and queues an atomic $addToSet for the next save"""
+    current = getattr(self, name)
+    for value in values:
+      if value not in current:
+        current.append(value)
+    self._queue("$addToSet", name, values)
+
+  def push(self, name: str, *values: Any):
+    """Appends values to a list field and queues an atomic $push for the next save"""
+    getattr(self, name).extend(values)
+    self._queue("$push", name, values)
+
+  def pull(self, name: str, *values: Any):
+    """Removes values from a list field and queues an atomic $pull for the next save"""
+    current = getattr(self, name)
+    current[:] = [value for value in current if value not in values]
+    self._queue("$pull", name, values)
+
+  def _delta(self) -> Dict[str, Dict[str, Any]]:
+    """Compiles the changes since tracking started into a minimal update document"""
+    delta = {}
+    for name in self._dirty:
+      value = getattr(self, name)
+      if value is None:
+        delta.setdefault("$unset", {})[name] = ""
+      else:
+        delta.setdefault("$set", {})[name] = value.value if isinstance(value, Enum) else value
+
+    for name, (op, values) in self._list_ops.items():
+      if name not in self._dirty:
+        delta.setdefault(op, {})[name] = {"$in": list(values)} if op == "$pull" else {"$each": list(values)}
+
+    return delta
+
+  def _saved(self, values: Dict[str, Any], list_ops: Dict[str, Tuple[str, List[Any]]]):
+    """Stops tracking what a save wrote, keeping the changes made while the write was pending"""
+    if self._dirty is None:
+      return
+
+    for name, value in values.items():
+      if getattr(self, name) is value:
+        self._dirty.discard(name)
+
+    for name, (op, sent) in list_ops.items():
+      queued = self._list_ops.get(name)
+      if queued is not None and queued[0] == op and queued[1][:len(sent)] == sent:
+        if len(queued[1]) > len(sent):
+          self._list_ops[name] = (op, queued[1][len(sent):])
+        else:
+          del self._list_ops[name]
+
+  def _written(self, action: str):
+    for callback in _write_listeners.get(getattr(self, "type", None) or self.__class__.__name__, []):
+      callback(self, action)
+
+  async def _write(self, actions: List[Any], action: str, done: Callable[[], Any] = None) -> Any:
+    """Enlists actions in the current unit of work of the table, or flushes them right away if there is none
+
+    done is called once the actions are written
+    Returns the BulkWriteResult when flushed here and None when enlisted
+    """
+    async with table_uow(self._table) as uow:
+      uow.add(actions, self, action, done)
+      enlisted = uow._depth > 1
+
+    return None if enlisted else uow.result
 
   @classmethod
   def _decompose_url(self, url: str) -> Dict[str, str]:
@@ -69,6 +269,49 @@ class MongoBase:
       _url = PurePath(url)
       return {"path": str(_url.parent), "slug": _url.name}
 
+  @classmethod
+  def _from_doc(cls, doc: Dict[str, Any], table: AsyncIOMotorCollection = None) -> 'Mongo':
+    ancestors, depth = doc.pop("ancestors", None), doc.pop("depth", None)
+    obj = hydrator(cls)(doc)
+    obj._table = table
+    obj._ancestors, obj._depth = ancestors, depth
+    obj._track()
+
+    return obj
+
+  def _reader(self, lazy: bool = False) -> Tuple[AsyncIOMotorCollection, Callable[[type, Dict[str, Any]], 'Mongo']]:
+    """Returns the table to read from and how to turn its documents into objects (views if lazy)"""
+    if lazy:
+      return raw_table(self._table), lambda model, doc: LazyView(model, doc, self._table)
+    else:
+      return self._table, lambda model, doc: model._from_doc(doc, self._table)
+
+  async def _lineage(self) -> Dict[str, Any]:
+    if self._ancestors is None:
+      parent = await self._table.find_one(self._decompose_url(self.path), {"ancestors": 1}) if self.path else None
+      self._ancestors = parent.get("ancestors", []) + [parent["_id"]] if parent else []
+    self._depth = len(self._ancestors)
+
+    return {"ancestors": self._ancestors, "depth": self._depth}
+
+  def _descendants_query(self) -> Dict[str, Any]:
+    return {"ancestors": self._id} if self._materialized and self._ancestors is not None else self._subtree_query(self.get_url())
+
+  @classmethod
+  def _subtree_query(cls, url: str, depth: int = None) -> Dict[str, Any]:
+    """Matches the documents under url (anchored at a path segment and served by the path index), up to depth levels below"""
+    if depth is not None:
+      if depth <= 1:
+        return {"path": url}
+
+      # The path of a document depth levels below has depth - 1 more segments than url
+      prefix = "/" if url == "/" else f"{url}/"
+      return {"$or": [{"path": url}, {"path": {"$regex": f"^{escape(prefix)}[^/]+(/[^/]+){{0,{depth - 2}}}$"}}]}
+    elif url == "/":
+      return {"path": {"$gte": "/", "$lt": "0"}}
+    else:
+      return {"$or": [{"path": url}, {"path": {"$gte": f"{url}/", "$lt": f"{url}0"}}]}
+
   @classmethod
   async def _get_doc(cls, table: AsyncIOMotorCollection, **query: Dict[str, Any]) -> Dict[str, Any]:
     sort = query.pop("sort") if "sort" in query else None
@@ -92,6 +335,36 @@ class MongoBase:
     else:
       return await table.find(query).to_list(None)
 
+  @classmethod
+  async def iter_docs(cls, table: AsyncIOMotorCollection, batch_size: int = 100, projection: Dict[str, Any] = None, limit: int = None, skip: int = None, **query: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """Yields the raw documents as the cursor batches arrive"""
+    sort = query.pop("sort") if "sort" in query else None
+    if "url" in query:
+      query.update(cls._decompose_url(query.pop("url")))
+
+    cursor = table.find(query, projection, batch_size = batch_size)
+    if sort:
+      cursor = cursor.sort(sort)
+    if skip:
+      cursor = cursor.skip(skip)
+    if limit:
+      cursor = cursor.limit(limit)
+
+    async for doc in cursor:
+      yield doc
+
+  @classmethod
+  async def agets(cls, table: AsyncIOMotorCollection, batch_size: int = 100, projection: Dict[str, Any] = None, limit: int = None, skip: int = None, **query: Dict[str, Any]) -> AsyncIterator['Mongo']:
+    """Like gets but yields the objects as the cursor batches arrive instead of loading them all
+
+    A projection must keep every field the model requires
+    """
+    if "type" not in query:
+      query["type"] = cls.__name__
+
+    async for doc in cls.iter_docs(table, batch_size, projection, limit, skip, **query):
+      yield cls._from_doc(doc, table)
+
   @classmethod
   async def get(cls, table: AsyncIOMotorCollection, **query: Dict[str, Any]) -> 'Mongo':
     if "type" not in query:
@@ -99,10 +372,7 @@ class MongoBase:
 
     doc = await cls._get_doc(table, **query)
     if doc:
-      obj = cls(**doc)
-      obj._table = table
-
-      return obj
+      return cls._from_doc(doc, table)
     else:
       return doc
 
@@ -113,58 +383,120 @@ class MongoBase:
 
     docs = await cls._get_docs(table, **query)
     if docs:
-      objs = []
-      for doc in docs:
-        obj = cls(**doc)
-        obj._table = table
-        objs.append(obj)
-
-      return objs
+      return [cls._from_doc(doc, table) for doc in docs]
     else:
       return docs
 
-  async def create(self, **kwargs: Dict[str, Any]):
-    if not kwargs:
-      kwargs = {
-        key: value.value if isinstance(value, Enum) else value
-        for key, value in asdict(self).items()
-        if value is not None
-      }
+  @classmethod
+  async def view(cls, table: AsyncIOMotorCollection, **query: Dict[str, Any]) -> LazyView:
+    """Like get but returns a read-only view over the raw BSON document"""
+    if "type" not in query:
+      query["type"] = cls.__name__
 
-    result = await self._table.insert_one(kwargs)
-    self._id = result.inserted_id
+    doc = await cls._get_doc(raw_table(table), **query)
+    return LazyView(cls, doc, table) if doc else doc
 
-  async def update(self, models: ModuleType, **kwargs: Dict[str, Any]):
+  @classmethod
+  async def views(cls, table: AsyncIOMotorCollection, **query: Dict[str, Any]) -> List[LazyView]:
+    """Like gets but returns read-only views over the raw BSON documents"""
+    if "type" not in query:
+      query["type"] = cls.__name__
+
+    return [LazyView(cls, doc, table) for doc in await cls._get_docs(raw_table(table), **query)]
+
+  def _to_doc(self) -> Dict[str, Any]:
+    return {
+      key: value.value if isinstance(value, Enum) else value
+      for key, value in asdict(self).items()
+      if value is not None
+    }
+
+  async def create(self, **kwargs: Dict[str, Any]):
+    if not kwargs:
+      kwargs = self._to_doc()
+
+    if self._materialized and "ancestors" not in kwargs:
+      kwargs.update(await self._lineage())
+
+    if "_id" not in kwargs:
+      kwargs["_id"] = self._id or ObjectId()
+    self._id = kwargs["_id"]
+    await self._write([InsertOne(kwargs)], "create")
+    self._track()
+
+  async def save(self, models: ModuleType = None) -> int:
+    """Writes just the fields changed and the list operations queued since the object was hydrated, created or saved
+
+    Changes to the fields the slug is built from go through update so the subtree follows the new url
+    Returns the number of modified documents or None when enlisted in a unit of work
+    """
+    if self._dirty is None:
+      raise ValueError(f"{self.__class__.__name__} ({self.name}) isn't tracking changes, use update instead")
+
+    delta = self._delta()
+    if not delta:
+      return 0
+
+    renamed = set(self.__sluger__(fields = True)) & self._dirty
+    # Tracking is reset once the write succeeds, a failed save can be retried
+    values = {name: getattr(self, name) for name in self._dirty}
+    list_ops = {name: (op, list(queued)) for name, (op, queued) in self._list_ops.items()}
+    done = lambda: self._saved(values, list_ops)
+
+    if renamed:
+      for op in ("$set", "$unset"):
+        for name in renamed:
+          delta.get(op, {}).pop(name, None)
+      delta = {op: values for op, values in delta.items() if values}
+
+      async with table_uow(self._table) as uow:
+        owned = uow._depth == 1
+        await MongoBase.update(self, models, **{name: getattr(self, name) for name in renamed})
+        if delta:
+          await self._write([UpdateOne({"_id": self._id}, delta)], "update")
+        uow.add([], done = done)
+      return uow.result.modified_count if owned else None
+
+    result = await self._write([UpdateOne({"_id": self._id}, delta)], "update", done)
+    return None if result is None else result.modified_count
+
+  async def update(self, models: ModuleType, **kwargs: Dict[str, Any]) -> int:
+    """Updates the document and, if its url changes, rewrites the path of its subtree on the server
+
+    Returns the number of modified documents
+    """
     actions = []
 
     if set(self.__sluger__(fields = True)) & set(kwargs.keys()):
       indexer = kwargs.pop("indexer") if "indexer" in kwargs else "slug"
-      kwargs["slug"] = slugify(self.__slugger__(kwargs))
+      kwargs["slug"] = slugify(self.__sluger__(kwargs))
       parent = await self.ancestors(models, True)
+      update_parent = []
       if parent:
-        update_parent = {}
         self_class = self.__class__.__name__
         for field in fields(parent):
-          if "model" in field.metadata and field.metadata["model"] == self_class:
-            brothers = getattr(parent, field.name)
-            key = getattr(self, "_id" if field.type == List[ObjectId] else indexer)
-            brothers[brothers.index(key)] = kwargs[indexer]
-            update_parent[field.name] = brothers
+          # Children stored by _id keep their reference, the others are renamed in place so concurrent $push/$pull aren't lost
+          if "model" in field.metadata and field.metadata["model"] == self_class and field.type != List[ObjectId]:
+            old = getattr(self, indexer)
+            update_parent.append(UpdateOne({"_id": parent._id, field.name: old}, {"$set": {f"{field.name}.$": kwargs[indexer]}}))
 
       url = self.get_url()
       new_url = get_url(kwargs.get("path", self.path), kwargs.get(indexer, getattr(self, indexer)))
-      async for child in self._table.find({"path": {"$regex": f"^{url}"}}):
-        actions.append(UpdateOne({"_id": child["_id"]}, {"$set": {"path": child["path"].replace(url, new_url, 1)}}))
-      if update_parent:
-        actions.append(UpdateOne({"_id": parent._id}, {"$set": update_parent}))
+      if new_url != url:
+        new_path = {"$concat": [new_url, {"$substrCP": ["$path", len(url), {"$strLenCP": "$path"}]}]}
+        actions.append(UpdateMany(self._descendants_query(), [{"$set": {"path": new_path}}]))
+      actions.extend(update_parent)
 
     actions.insert(0, UpdateOne({"_id": self._id}, {"$set": kwargs}))
-    async with await self._table.database.client.start_session() as s:
-      async with s.start_transaction():
-        await self._table.bulk_write(actions)
+    def written():
+      if self._dirty is not None:
+        self._dirty -= kwargs.keys()
+    result = await self._write(actions, "update", written)
 
     for key, val in kwargs.items():
-      setattr(self, key, val)
+      object.__setattr__(self, key, val)
+
+    return None if result is None else result.modified_count
 
   async def delete(self, models: ModuleType, indexer: str = "slug"):
     children = {}
@@ -172,23 +504,20 @@ class MongoBase:
     if parent:
       self_class = self.__class__.__name__
       for field in fields(parent):
-        if "model" in field.metadata and field.metadata["model"] == self_class:
-          childs = getattr(parent, field.name)
-          childs.remove(getattr(self, "_id" if field.type == List[ObjectId] else indexer))
-          children[field.name] = childs
+        if "model" in field.metadata and field.metadata["model"] == self_class and isinstance(getattr(parent, field.name), list):
+          children[field.name] = getattr(self, "_id" if field.type == List[ObjectId] else indexer)
 
-    actions = [DeleteOne({"_id": self._id}), DeleteMany({"path": {"$regex": f"^{self.get_url()}"}})]
+    actions = [DeleteOne({"_id": self._id}), DeleteMany(self._descendants_query())]
     if children:
-      actions.append(UpdateOne({"_id": parent._id}, {"$set": children}))
-    async with await self._table.database.client.start_session() as s:
-      async with s.start_transaction():
-        await self._table.bulk_write(actions)
+      # An atomic $pull, a concurrent create_child $push to the same list survives it
+      actions.append(UpdateOne({"_id": parent._id}, {"$pull": children}))
+    await self._write(actions, "delete")
 
     self.id_ = None
 
-  async def create_child(self, child: 'Mongo', models: ModuleType, as_: str = None, indexer: str = None):
+  def _child_field(self, child_class: str, as_: str = None, indexer: str = None) -> Tuple[str, str]:
+    """Returns the field that stores children of child_class and the indexer they are stored by"""
     if as_ is None:
-      child_class = child.__class__.__name__
       children = list(filter(lambda f: "model" in f.metadata and f.metadata["model"] == child_class, fields(self)))
       if len(children) > 1:
         children_names = list(map(lambda c: c.name, children))
@@ -198,34 +527,161 @@ class MongoBase:
         if children[0].type == List[ObjectId]:
           indexer = "_id"
       else:
-        raise ChildrenAbiguity(f"{self.__class__.__name__} ({self.name}) can't store {child.__class__.__name__}")
+        raise ChildrenAbiguity(f"{self.__class__.__name__} ({self.name}) can't store {child_class}")
+
+    return as_, indexer
+
+  @staticmethod
+  def _child_index(child: 'Mongo', indexer: str = None) -> Any:
+    if indexer:
+      return getattr(child, indexer)
+    elif hasattr(child, "__indexer__"):
+      return getattr(child, child.__indexer__)
+    else:
+      return child.slug
+
+  async def create_child(self, child: 'Mongo', models: ModuleType, as_: str = None, indexer: str = None):
+    as_, indexer = self._child_field(child.__class__.__name__, as_, indexer)
 
     child._table = self._table
-    children = getattr(self, as_)
-    update = {}
-    async with await self._table.database.client.start_session() as s:
-      async with s.start_transaction():
-        child.path = self.get_url()
-        await child.create()
-        if indexer:
-          idx = getattr(child, indexer)
-        elif hasattr(child, "__indexer__"):
-          idx = getattr(child, child.__indexer__)
-        else:
-          idx = child.slug
+    async with table_uow(self._table):
+      child.path = self.get_url()
+      if self._ancestors is not None:
+        child._ancestors = self._ancestors + [self._id]
+      await child.create()
+      idx = self._child_index(child, indexer)
+
+      children = getattr(self, as_)
+      if isinstance(children, list):
+        children.append(idx)
+        await self._write([UpdateOne({"_id": self._id}, {"$push": {as_: idx}})], "update")
+      else:
+        await MongoBase.update(self, models, **{as_: idx})
 
-        if isinstance(children, list):
-          children.append(idx)
-        else:
-          children = idx
-        update[as_] = children
+  async def create_children(self, children: List['Mongo'], as_: str = None, indexer: str = None) -> Dict[str, List[Any]]:
+    """Creates many children with one insert_many and one $push to this document inside a transaction
 
-        await MongoBase.update(self, models, **update)
+    Invalid or duplicated children don't abort the batch, they are returned as errors ({"index", "slug", "error"}) along with the created ones
+    Inside a unit of work on the same table the inserts and the $push are enlisted in it instead:
+    they are written when it flushes and a child that fails then (a concurrent duplicate) fails the whole unit
+    """
+    created, errors = [], []
+    if not children:
+      return {"created": created, "errors": errors}
 
-  async def ancestors(self, models: ModuleType, parent = False) -> Union['Mongo', List['Mongo']]:
+    as_, indexer = self._child_field(children[0].__class__.__name__, as_, indexer)
+    if not isinstance(getattr(self, as_), list):
+      raise ChildrenAbiguity(f"{self.__class__.__name__} ({self.name}) can store just one child as {as_}")
+
+    url = self.get_url()
+    model_name = next(f.metadata["model"] for f in fields(self) if f.name == as_)
+    # The children share their lineage, it's computed once from this document
+    if self._materialized:
+      lineage = (await self._lineage())["ancestors"] + [self._id]
+    else:
+      lineage = self._ancestors + [self._id] if self._ancestors is not None else None
+    candidates, slugs = [], set()
+    for idx, child in enumerate(children):
+      error = None
+      if child.__class__.__name__ != model_name:
+        error = f"{as_} can't store {child.__class__.__name__}"
+      elif child.slug in slugs:
+        error = "Duplicated in the batch"
+      else:
+        try:
+          if isinstance(child, JsonSchemaMixin):
+            child.to_dict(validate = True)
+        except ValidationError as e:
+          error = f"Validation error: {e}"
+
+      if error:
+        errors.append({"index": idx, "slug": child.slug, "error": error})
+      else:
+        slugs.add(child.slug)
+        child._table, child.path, child._ancestors = self._table, url, lineage
+        child._depth = None if lineage is None else len(lineage)
+        if child._id is None:
+          child._id = ObjectId()
+        candidates.append((idx, child))
+
+    def split(existing: Set[str]) -> Tuple[List[Dict[str, Any]], List[Tuple[int, 'Mongo']]]:
+      docs, inserting = [], []
+      for idx, child in candidates:
+        if child.slug in existing:
+          errors.append({"index": idx, "slug": child.slug, "error": "Already exists"})
+        else:
+          doc = child._to_doc()
+          if self._materialized:
+            doc.update({"ancestors": lineage, "depth": len(lineage)})
+          docs.append(doc)
+          inserting.append((idx, child))
+      return docs, inserting
+
+    uow = _current_uow.get()
+    if uow is not None and uow.table is self._table and candidates:
+      cursor = self._table.find({"path": url, "slug": {"$in": list(slugs)}}, {"slug": 1})
+      docs, inserting = split({doc["slug"] async for doc in cursor})
+      created = [child for _, child in inserting]
+      for doc, child in zip(docs, created):
+        uow.add([InsertOne(doc)], child, "create", child._track)
+      if created:
+        indexes = [self._child_index(child, indexer) for child in created]
+        uow.add([UpdateOne({"_id": self._id}, {"$push": {as_: {"$each": indexes}}})], self, "update", lambda: getattr(self, as_).extend(indexes))
+
+      return {"created": created, "errors": sorted(errors, key = lambda error: error["index"])}
+
+    while candidates:
+      inserting = []
+      try:
+        async with await self._table.database.client.start_session() as s:
+          async with s.start_transaction():
+            cursor = self._table.find({"path": url, "slug": {"$in": [child.slug for _, child in candidates]}}, {"slug": 1}, session = s)
+            docs, inserting = split({doc["slug"] async for doc in cursor})
+
+            if docs:
+              indexes = [self._child_index(child, indexer) for _, child in inserting]
+              await self._table.insert_many(docs, ordered = False, session = s)
+              await self._table.update_one({"_id": self._id}, {"$push": {as_: {"$each": indexes}}}, session = s)
+      except BulkWriteError as e:
+        # A write error aborts the transaction: the failed documents become errors and the rest is retried
+        failed = {error["index"]: error for error in e.details.get("writeErrors", [])}
+        if not failed:
+          raise
+
+        for position, (idx, child) in enumerate(inserting):
+          if position in failed:
+            error = failed[position]
+            errors.append({"index": idx, "slug": child.slug, "error": "Already exists" if error.get("code") == 11000 else error.get("errmsg", "Write error")})
+        candidates = [candidate for position, candidate in enumerate(inserting) if position not in failed]
+        continue
+
+      created = [child for _, child in inserting]
+      break
+
+    getattr(self, as_).extend(self._child_index(child, indexer) for child in created)
+    for child in created:
+      child._track()
+      child._written("create")
+    if created:
+      self._written("update")
+
+    return {"created": created, "errors": sorted(errors, key = lambda error: error["index"])}
+
+  async def ancestors(self, models: ModuleType, parent = False, lazy: bool = False) -> Union['Mongo', List['Mongo']]:
+    table, build = self._reader(lazy)
     url = PurePath(self.get_url())
     if str(url) == "/":
       return None
+    elif self._materialized and self._ancestors is not None:
+      ids = self._ancestors[-1:] if parent else self._ancestors
+      ancestors = []
+      async for doc in table.find({"_id": {"$in": ids}}).sort([("depth", -1)]):
+        ancestor = build(getattr(models, doc["type"]), doc)
+        if parent:
+          return ancestor
+        ancestors.append(ancestor)
+
+      return ancestors
     else:
       query = [{"path": str(parent.parent), "slug": parent.name} for parent in url.parents if str(parent) != "/"]
       query.append({"path": ""})
@@ -233,27 +689,53 @@ class MongoBase:
         query = query[0:1]
 
       ancestors = []
-      async for doc in self._table.find({"$or": query}).sort([("path", -1)]):
-        ancestor = getattr(models, doc["type"])(**doc)
-        ancestor._table = self._table
+      async for doc in table.find({"$or": query}).sort([("path", -1)]):
+        ancestor = build(getattr(models, doc["type"]), doc)
         if parent:
           return ancestor
         ancestors.append(ancestor)
 
       return ancestors
 
-  async def children(self, models: Union[ModuleType, List[Tree]], sort = None,  extra = None):
+  async def subtree(self, models: ModuleType, depth: int = None, types: List[str] = None, allowed: Callable[['Mongo'], Awaitable[bool]] = None) -> Dict[str, Any]:
+    """Fetches the descendants (up to depth levels below and of the given types) in one query
+
+    Descendants allowed rejects are left as references and their own descendants aren't mounted
+    Returns the plain dict of the object with its children mounted in its list fields
+    """
+    query = self._descendants_query()
+    if depth is not None:
+      if "ancestors" in query:
+        query["depth"] = {"$lte": self._depth + depth}
+      else:
+        query = self._subtree_query(self.get_url(), depth)
+    if types:
+      query["type"] = {"$in": types}
+
+    registry = model_registry(models)
+    elements = []
+    async for doc in self._table.find(query):
+      if doc["type"] in registry:
+        obj = registry[doc["type"]]._from_doc(doc, self._table)
+        if allowed is None or await allowed(obj):
+          elements.append(obj.to_plain_dict())
+
+    return mount_tree(elements, self.to_plain_dict(), models)
+
+  async def children(self, models: Union[ModuleType, List[Tree]], sort = None, extra = None, facet: bool = True, lazy: bool = False) -> Dict[str, List['Mongo']]:
+    """Returns the children of every list field
+
+    All the lists are resolved with one $facet aggregation or, when facets can't apply (facet = False or forbidden stages), with concurrent aggregations
+    With lazy the children are read-only views over the raw documents
+    """
+    table, build = self._reader(lazy)
     url = self.get_url()
-    if isinstance(models, list):
-      models_ = {model.__name__: model for model in models}
-    else:
-      models_ = {model[0]: model[1] for model in getmembers(models, lambda m: isclass(m) and issubclass(m, Mongo))}
-    models_names = models_.keys()
+    models_ = {model.__name__: model for model in models} if isinstance(models, list) else model_registry(models)
 
-    results = {}
+    pipelines = {}
     for field in fields(self):
       model_name = field.metadata.get("model", None)
-      if model_name and model_name in models_names:
+      if model_name and model_name in models_:
         indexes = getattr(self, field.name)
 
         if field.type == List[ObjectId]:
@@ -265,20 +747,49 @@ class MongoBase:
           match.update(extra[model_name] if model_name in extra else extra)
 
         if sort is None:
-          addOrder = {"$addFields": {"__order": {"$indexOfArray": [indexes, indexer]}}}
-          sort = {"$sort": {"__order": 1}}
-          aggregation = [match, addOrder, sort]
+          aggregation = [match, {"$addFields": {"__order": {"$indexOfArray": [indexes, indexer]}}}, {"$sort": {"__order": 1}}]
         else:
           aggregation = [match, sort[model_name] if model_name in sort else sort]
 
-        results[field.name] = []
-        model = models_[model_name]
-        async for doc in self._table.aggregate(aggregation):
+        pipelines[field.name] = (models_[model_name], aggregation)
+
+    if facet and len(pipelines) > 1 and self._facetable(pipelines):
+      try:
+        docs = await self._facet(pipelines, table)
+      except OperationFailure as e:
+        if e.code not in DOCUMENT_TOO_LARGE:
+          raise
+        docs = await self._aggregations(pipelines, table)
+    else:
+      docs = await self._aggregations(pipelines, table)
+
+    results = {}
+    for name, (model, _) in pipelines.items():
+      results[name] = []
+      for doc in docs[name]:
+        if not lazy:
           doc.pop("__order", None)
-          results[field.name].append(model(**doc))
+        results[name].append(build(model, doc))
 
     return results
 
+  @staticmethod
+  def _facetable(pipelines: Dict[str, Any]) -> bool:
+    for _, aggregation in pipelines.values():
+      if "$match" not in aggregation[0] or any(FACET_FORBIDDEN & stage.keys() for stage in aggregation):
+        return False
+    return True
+
+  async def _facet(self, pipelines: Dict[str, Any], table: AsyncIOMotorCollection) -> Dict[str, List[Dict[str, Any]]]:
+    prefilter = {"$match": {"$or": [aggregation[0]["$match"] for _, aggregation in pipelines.values()]}}
+    facets = {"$facet": {name: aggregation for name, (_, aggregation) in pipelines.items()}}
+    result = await table.aggregate([prefilter, facets]).to_list(1)
+    return result[0] if result else {name: [] for name in pipelines}
+
+  async def _aggregations(self, pipelines: Dict[str, Any], table: AsyncIOMotorCollection) -> Dict[str, List[Dict[str, Any]]]:
+    docs = await gather(*[table.aggregate(aggregation).to_list(None) for _, aggregation in pipelines.values()])
+    return dict(zip(pipelines.keys(), docs))
+
 @dataclass
 class Mongo(MongoBase):
   _id: ObjectId = None
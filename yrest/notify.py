@@ -0,0 +1,123 @@
+from asyncio import Semaphore, Task, ensure_future, sleep, wait
+from datetime import datetime, timedelta
+from importlib import import_module
+from inspect import isawaitable
+from typing import Any, Awaitable, Callable, Dict
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from sanic.log import logger
+
+from yrest.mongo import MongoBase
+
+# The type (and path) of the outbox entries stored along the app's documents
+OUTBOX = "__outbox__"
+
+def encode_kwargs(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+  """Replaces the documents in kwargs by references so they can be stored"""
+  return {
+    key: {"__ref__": f"{value.__class__.__module__}:{value.__class__.__qualname__}", "_id": value._id} if isinstance(value, MongoBase) else value
+    for key, value in kwargs.items()
+  }
+
+async def decode_kwargs(kwargs: Dict[str, Any], table: AsyncIOMotorCollection) -> Dict[str, Any]:
+  """Loads the documents referenced by encode_kwargs (None if they don't exist anymore)"""
+  result = {}
+  for key, value in kwargs.items():
+    if isinstance(value, dict) and "__ref__" in value:
+      module, _, name = value["__ref__"].partition(":")
+      value = await getattr(import_module(module), name).get(table, _id = value["_id"])
+    result[key] = value
+  return result
+
+class Notifier:
+  """Runs notifications in background tasks, at most concurrency of them at a time
+
+  With an outbox table each notification is stored before it runs and deleted once it succeeds
+  Entries left by failures or restarts are replayed once they haven't been claimed for lease seconds
+  """
+  def __init__(self, run: Callable[[str, Any, Dict[str, Any]], Awaitable], concurrency: int = 10):
+    self._run = run
+    self._slots: Semaphore = None
+    self._pending = set()
+    self.concurrency = concurrency
+    self.table: AsyncIOMotorCollection = None
+    self.lease = 300
+    self.max_attempts = 5
+
+  def configure(self, concurrency: int = 10, table: AsyncIOMotorCollection = None, lease: float = 300, max_attempts: int = 5):
+    self.concurrency, self.table, self.lease, self.max_attempts = concurrency, table, lease, max_attempts
+    self._slots = None
+
+  @property
+  def pending(self) -> int:
+    return len(self._pending)
+
+  async def dispatch(self, name: str, request: Any, kwargs: Dict[str, Any], entry: Dict[str, Any] = None) -> Task:
+    """Schedules the notification and returns its task without waiting for it"""
+    if self._slots is None:
+      self._slots = Semaphore(self.concurrency)
+
+    if self.table is not None and entry is None:
+      _id = ObjectId()
+      entry = {"_id": _id, "type": OUTBOX, "path": OUTBOX, "slug": str(_id), "notification": name, "kwargs": encode_kwargs(kwargs), "attempts": 0, "claimed_at": datetime.utcnow()}
+      await self.table.insert_one(entry)
+
+    task = ensure_future(self._execute(name, request, kwargs, entry))
+    self._pending.add(task)
+    task.add_done_callback(self._pending.discard)
+    return task
+
+  async def _execute(self, name: str, request: Any, kwargs: Dict[str, Any], entry: Dict[str, Any] = None):
+    async with self._slots:
+      try:
+        result = await self._run(name, request, kwargs)
+        if isawaitable(result):
+          await result
+      except Exception as e:
+        logger.error(f"Notification {name} failed: {e}")
+        if entry is not None:
+          await self.table.update_one({"_id": entry["_id"]}, {"$inc": {"attempts": 1}})
+        return
+
+    if entry is not None:
+      await self.table.delete_one({"_id": entry["_id"]})
+
+  async def drain(self, timeout: float = None):
+    """Waits up to timeout seconds for the running notifications, the outbox keeps the unfinished ones"""
+    if self._pending:
+      await wait(set(self._pending), timeout = timeout)
+
+  async def replay(self) -> int:
+    """Dispatches the outbox entries nobody has claimed in the last lease seconds and returns how many"""
+    count = 0
+    while True:
+      now = datetime.utcnow()
+      entry = await self.table.find_one_and_update(
+        {"type": OUTBOX, "attempts": {"$lt": self.max_attempts}, "claimed_at": {"$lt": now - timedelta(seconds = self.lease)}},
+        {"$set": {"claimed_at": now}},
+        return_document = ReturnDocument.AFTER
+      )
+      if entry is None:
+        return count
+
+      try:
+        kwargs = await decode_kwargs(entry["kwargs"], self.table)
+      except (ImportError, AttributeError) as e:
+        logger.error(f"Notification {entry['notification']} can't be replayed: {e}")
+        await self.table.update_one({"_id": entry["_id"]}, {"$set": {"attempts": self.max_attempts}})
+        continue
+
+      # There's no request when replaying
+      await self.dispatch(entry["notification"], None, kwargs, entry)
+      count += 1
+
+  async def replay_forever(self):
+    while True:
+      try:
+        await self.replay()
+      except Exception as e:
+        logger.error(f"Outbox replay failed: {e}")
+      await sleep(self.lease)
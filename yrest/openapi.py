@@ -1,5 +1,8 @@
 from inspect import getmro
-from typing import Union, List, Dict, Any
+from typing import Union, List, Dict, Any, Tuple
+from json import dumps
+from gzip import compress
+from hashlib import sha256
 import re
 from dataclasses import fields
 
@@ -9,8 +12,14 @@ from sanic.request import Request
 from dataclasses_jsonschema import JsonSchemaMixin, SchemaType
 
 from yrest.tree import Tree
+from yrest.utils import NDJSON
 
 class OpenApi():
+  # The serialized document, its gzip copy and its ETag, built on the first request
+  _openapi_cache: Tuple[bytes, bytes, str] = None
+  # Paths, schemas and parameters restored from an introspection snapshot
+  _openapi_inputs: Dict[str, Any] = None
+
   def v3(self):
     result = {"openapi": "3.0.1"}
 
@@ -21,15 +30,20 @@ class OpenApi():
     if "OA_SERVER_DESCRIPTION" in c_keys:
       result["servers"] = [{"url": self.config["SERVER_NAME"], "description": self.config["OA_SERVER_DESCRIPTION"]}]
 
-    result["paths"] = self._paths()
-
-    schemas = self._correct_schemas(JsonSchemaMixin.all_json_schemas(schema_type = SchemaType.OPENAPI_3))
-    result["components"] = {"x-root": self._root_model.__name__, "schemas": schemas}
-    if hasattr(self, "_params"):
-      result["components"]["parameters"] = self._params
+    inputs = self._openapi_inputs or self._build_openapi_inputs()
+    result["paths"] = inputs["paths"]
+    result["components"] = {"x-root": self._root_model.__name__, "schemas": inputs["schemas"]}
+    if inputs["parameters"] is not None:
+      result["components"]["parameters"] = inputs["parameters"]
 
     return result
 
+  def _build_openapi_inputs(self) -> Dict[str, Any]:
+    """Builds the parts of the document that only depend on the models"""
+    paths = self._paths()
+    schemas = self._correct_schemas(JsonSchemaMixin.all_json_schemas(schema_type = SchemaType.OPENAPI_3))
+    return {"paths": paths, "schemas": schemas, "parameters": getattr(self, "_params", None)}
+
   def _paths(self):
     regex = re.compile("\/new\/\w+$")
     regexsub = re.compile("\/create_\w+$")
@@ -79,7 +93,10 @@ class OpenApi():
           if "description" in e_data:
             p[url][verb]["responses"][200]["description"] = e_data["description"]
 
-          p[url][verb]["responses"][200].update(self._content(e_data["produces"]))
+          if e_data.get("streams", False):
+            p[url][verb]["responses"][200].update(self._stream_content(e_data["produces"]))
+          else:
+            p[url][verb]["responses"][200].update(self._content(e_data["produces"]))
 
         if "can_crash" in e_keys:
           for error in e_data["can_crash"].values():
@@ -190,6 +207,12 @@ class OpenApi():
     content[mime] = {"schema": self._ref(model[1].__name__ if isinstance(model, tuple) else model.__name__)}
     return {"content": content}
 
+  def _stream_content(self, model: Tree):
+    """Members returning async iterables stream each item as NDJSON or as a JSON list"""
+    item = self._ref(model[1].__name__ if isinstance(model, tuple) else model.__name__)
+    as_list = {"allOf": [self._ref("OkListResult"), {"type": "object", "properties": {"result": {"type": "array", "items": item}}}]}
+    return {"content": {"application/json": {"schema": as_list}, NDJSON: {"schema": item}}}
+
   def _ref(self, model: Tree, context: str = "schemas"):
     return {"$ref": f"#/components/{context}/{model}"}
 
@@ -212,6 +235,27 @@ class OpenApi():
 
     return schemas
 
+  def _openapi_document(self) -> Tuple[bytes, bytes, str]:
+    if self._openapi_cache is None:
+      body = dumps(self.v3(), separators = (",", ":")).encode()
+      self._openapi_cache = (body, compress(body), f'"{sha256(body).hexdigest()[:32]}"')
+    return self._openapi_cache
+
+  def invalidate_openapi(self):
+    """Drops the built document so the next request rebuilds it. Call it whenever the models are reloaded"""
+    self._openapi_cache = None
+
   def openapi(self, request: Request) -> Dict[str, str]:
     """Returns tha API's OpenAPI definition"""
-    return response.json(self.v3())
+    body, gzipped, etag = self._openapi_document()
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+
+    if_none_match = request.headers.get("If-None-Match", "")
+    if if_none_match.strip() == "*" or etag in (tag.strip().replace("W/", "", 1) for tag in if_none_match.split(",")):
+      return response.raw(b"", status = 304, headers = headers)
+
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+      headers["Content-Encoding"] = "gzip"
+      return response.raw(gzipped, headers = headers, content_type = "application/json")
+
+    return response.raw(body, headers = headers, content_type = "application/json")
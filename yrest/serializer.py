@@ -0,0 +1,110 @@
+from typing import Any, Callable, Dict, Union, get_type_hints
+from dataclasses import fields, is_dataclass
+from json import JSONEncoder
+from enum import Enum
+
+from dataclasses_jsonschema import JsonSchemaMixin
+
+_wire_types: Dict[type, Callable[[Any], Any]] = {}
+_compatible_encoders = set()
+_serializers: Dict[type, Callable[[Any], Dict[str, Any]]] = {}
+
+def register_wire_types(types: Dict[type, Callable[[Any], Any]], encoder: JSONEncoder = None):
+  """Registers how values of the given types become wire values
+
+  If encoder is given, to_plain_dict will use the compiled serializers for models using it (or a subclass) as _encoder
+  """
+  _wire_types.update(types)
+  if encoder is not None:
+    _compatible_encoders.add(encoder)
+
+def is_compatible(encoder: JSONEncoder) -> bool:
+  return encoder is None or any(issubclass(encoder, compatible) for compatible in _compatible_encoders)
+
+def to_wire(value: Any) -> Any:
+  """Converts a value of unknown type to its wire representation"""
+  if value is None or isinstance(value, (str, int, float, bool)):
+    return value
+  elif isinstance(value, dict):
+    return {key: to_wire(val) for key, val in value.items()}
+  elif isinstance(value, (list, tuple, set, frozenset)):
+    return [to_wire(val) for val in value]
+  elif isinstance(value, Enum):
+    return value.value
+  elif is_dataclass(value) and not isinstance(value, type):
+    return serializer(value.__class__)(value)
+
+  for type_, convert in _wire_types.items():
+    if isinstance(value, type_):
+      return convert(value)
+
+  return value
+
+def _converter(type_: Any) -> Callable[[Any], Any]:
+  """Returns the function that converts a value of type_ or None when the value is already a wire value
+
+  Values of unknown type (Any, untyped containers) go through to_wire
+  """
+  if type_ in (str, int, float, bool):
+    return None
+  elif type_ in _wire_types:
+    return _wire_types[type_]
+  elif type_ in JsonSchemaMixin._field_encoders:
+    encoder = JsonSchemaMixin._field_encoders[type_]
+    return lambda value: to_wire(encoder.to_wire(value))
+  elif hasattr(type_, "__supertype__"):
+    return _converter(type_.__supertype__)
+  elif isinstance(type_, type) and issubclass(type_, Enum):
+    return lambda value: value.value
+  elif isinstance(type_, type) and is_dataclass(type_):
+    return lambda value: serializer(value.__class__)(value)
+
+  origin, args = getattr(type_, "__origin__", None), getattr(type_, "__args__", None) or ()
+  if origin is Union:
+    variants = [_converter(arg) for arg in args if arg is not type(None)]
+    return None if all(variant is None for variant in variants) else to_wire
+  elif origin in (list, set, frozenset, tuple):
+    item = _converter(args[0]) if args and args[0] is not Ellipsis else None
+    if item is None:
+      return None if origin is list else list
+    return lambda value: [item(val) for val in value]
+  elif origin is dict:
+    if len(args) != 2:
+      return to_wire
+    item = _converter(args[1])
+    # Loosely typed fields (like the result of the envelopes) can hold other objects, those go through to_wire
+    return None if item is None else lambda value: {key: item(val) for key, val in value.items()} if isinstance(value, dict) else to_wire(value)
+
+  return to_wire
+
+def _compile(cls: type) -> Callable[[Any], Dict[str, Any]]:
+  try:
+    hints = get_type_hints(cls)
+  except (NameError, TypeError):
+    hints = {}
+
+  mapping = cls.field_mapping() if issubclass(cls, JsonSchemaMixin) else {}
+  exclude = set(getattr(cls, "__exclude__", []))
+  plan = tuple(
+    (field.name, mapping.get(field.name, field.name), _converter(hints.get(field.name, field.type)))
+    for field in fields(cls)
+    if not field.name.startswith("__") and field.name not in exclude
+  )
+
+  def serialize(obj: Any) -> Dict[str, Any]:
+    result = {}
+    for name, key, convert in plan:
+      value = getattr(obj, name)
+      if value is not None:
+        result[key] = value if convert is None else convert(value)
+    return result
+
+  return serialize
+
+def serializer(cls: type) -> Callable[[Any], Dict[str, Any]]:
+  """Returns the serializer of a dataclass, compiling it the first time"""
+  try:
+    return _serializers[cls]
+  except KeyError:
+    _serializers[cls] = _compile(cls)
+    return _serializers[cls]
@@ -0,0 +1,68 @@
+"""Pre-warms the introspection snapshot of a yRest app so its workers skip introspecting the models
+
+  python -m yrest.snapshot my_app:app [snapshot.pickle]
+"""
+from argparse import ArgumentParser
+from hashlib import sha256
+from importlib import import_module
+from inspect import getmembers, getmodule, isclass
+from os import getpid, replace
+from pathlib import Path
+from pickle import dump, load, HIGHEST_PROTOCOL, UnpicklingError
+from sys import modules
+from types import ModuleType
+from typing import Any, Dict, Set
+
+def _model_sources(models: ModuleType) -> Set[Path]:
+  """The files the models come from: the models module, its package's modules and the modules defining its classes"""
+  sources = {Path(models.__file__)}
+  for path in getattr(models, "__path__", []):
+    sources.update(Path(path).rglob("*.py"))
+
+  prefix = f"{models.__name__}."
+  loaded = [module for name, module in list(modules.items()) if name.startswith(prefix)]
+  defining = [getmodule(cls) for _, cls in getmembers(models, isclass)]
+  for module in loaded + defining:
+    if getattr(module, "__file__", None):
+      sources.add(Path(module.__file__))
+
+  return {source for source in sources if source.is_file()}
+
+def snapshot_key(models: ModuleType, root_name: str) -> str:
+  """Hashes the models' sources and yrest's, so any change to them invalidates the snapshot"""
+  digest = sha256(root_name.encode())
+  for source in sorted(_model_sources(models) | set(Path(__file__).parent.glob("*.py"))):
+    digest.update(str(source).encode())
+    digest.update(source.read_bytes())
+  return digest.hexdigest()
+
+def load_snapshot(path: str, key: str) -> Dict[str, Any]:
+  """Returns the snapshot stored at path if it was made for key, None otherwise"""
+  try:
+    with open(path, "rb") as f:
+      snapshot = load(f)
+  except (OSError, EOFError, UnpicklingError, AttributeError, ImportError):
+    return None
+
+  return snapshot if isinstance(snapshot, dict) and snapshot.get("key") == key else None
+
+def save_snapshot(path: str, snapshot: Dict[str, Any]):
+  # Written aside and renamed so workers starting at the same time never read half a file
+  tmp = f"{path}.{getpid()}.tmp"
+  with open(tmp, "wb") as f:
+    dump(snapshot, f, HIGHEST_PROTOCOL)
+  replace(tmp, path)
+
+def main():
+  parser = ArgumentParser(description = "Writes the introspection snapshot of a yRest app")
+  parser.add_argument("app", help = "The app as module:attribute")
+  parser.add_argument("path", nargs = "?", help = "Where to write it (defaults to the app's snapshot path)")
+  args = parser.parse_args()
+
+  module, _, attribute = args.app.partition(":")
+  app = getattr(import_module(module), attribute or "app")
+  path = app.save_snapshot(args.path)
+  print(f"Snapshot written to {path}")
+
+if __name__ == "__main__":
+  main()
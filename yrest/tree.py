@@ -10,6 +10,7 @@ from dataclasses_jsonschema.field_types import DateTimeFieldEncoder
 from slugify import slugify
 
 from yrest.utils import get_url
+from yrest.serializer import serializer, is_compatible
 
 Email = NewType("Email", str)
 class EmailField(FieldEncoder):
@@ -82,6 +83,9 @@ class TreeBase:
     if encoder is None and hasattr(self, "_encoder"):
       encoder = self._encoder.default if isinstance(self._encoder, Field) else self._encoder
 
+    if is_compatible(encoder):
+      return serializer(self.__class__)(self)
+
     result = loads(self.to_json(cls = encoder))
 
     for exclude in getattr(self, "__exclude__", []):
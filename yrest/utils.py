@@ -1,10 +1,15 @@
-from typing import Any, List, Dict, Callable
+from types import ModuleType
+from typing import Any, List, Dict, Tuple, Callable
 from functools import wraps
 from pathlib import PurePath
-from dataclasses import dataclass, fields
+from dataclasses import dataclass, field, fields
+
+from bson import ObjectId
 
 from dataclasses_jsonschema import JsonSchemaMixin
 
+NDJSON = "application/x-ndjson"
+
 class Result:
   code = int
 
@@ -30,6 +35,16 @@ class Error(JsonSchemaMixin, Result):
 class ErrorMessage(Error, JsonSchemaMixin):
   message: str = None
 
+@dataclass
+class FieldError(JsonSchemaMixin):
+  field: str
+  message: str
+
+@dataclass
+class ValidationErrors(ErrorMessage, JsonSchemaMixin):
+  code: int = 400
+  errors: List[FieldError] = field(default_factory = list)
+
 def get_url(path: str, slug: str) -> str:
   if path is None or not path:
     return "/"
@@ -69,22 +84,53 @@ def get_parents_urls(url: str) -> List[str]:
 
   return urls
 
+_model_lists: Dict[Tuple[ModuleType, str], List[Tuple[str, bool]]] = {}
+
+def _model_list_fields(models: ModuleType, model: str) -> List[Tuple[str, bool]]:
+  """Returns (name, indexed by _id) for every field of model that stores children, cached per type"""
+  key = (models, model)
+  if key not in _model_lists:
+    _model_lists[key] = [(field.name, field.type == List[ObjectId]) for field in fields(getattr(models, model)) if "model" in field.metadata]
+  return _model_lists[key]
+
 def get_model_lists(models, model):
-  return [field.name for field in fields(getattr(models, model)) if "model" in field.metadata]
+  return [name for name, _ in _model_list_fields(models, model)]
 
 def mount_tree(elements, obj, models):
-  from sanic.log import logger
-  url = get_url(obj["path"], obj["slug"])
+  """Replaces the children references of obj (and its descendants) with the matching elements
+
+  Elements are indexed by (path, slug) and _id in one pass. References without a matching element are left as they are
+  """
+  by_url, by_id = {}, {}
+  for element in elements:
+    by_url[(element["path"], element["slug"])] = element
+    if "_id" in element:
+      by_id[str(element["_id"])] = element
+
   obj["lists"] = get_model_lists(models, obj["type"])
-  for lst in obj["lists"]:
-    for idx, child in enumerate(obj[lst]):
-      idx2 = None
-      for idx2, el in enumerate(elements):
-        if el["path"] == url and el["slug"] == child:
-          break
-
-      element = elements.pop(idx2)
-      obj[lst][idx] = mount_tree(elements, element, models) if get_model_lists(models, element["type"]) else element
+  pending, mounted = [obj], {id(obj)}
+  while pending:
+    node = pending.pop()
+    url = get_url(node["path"], node["slug"])
+    for name, by_oid in _model_list_fields(models, node["type"]):
+      if node.get(name) is None:
+        continue
+
+      refs = node[name] if isinstance(node[name], list) else [node[name]]
+      children = []
+      for ref in refs:
+        child = by_id.get(str(ref)) if by_oid else by_url.get((url, ref))
+        if child is None:
+          children.append(ref)
+          continue
+
+        children.append(child)
+        if id(child) not in mounted and _model_list_fields(models, child["type"]):
+          mounted.add(id(child))
+          child["lists"] = get_model_lists(models, child["type"])
+          pending.append(child)
+
+      node[name] = children if isinstance(node[name], list) else children[0]
 
   return obj
 
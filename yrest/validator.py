@@ -0,0 +1,68 @@
+from typing import Any, Callable, Dict, List, Tuple
+
+from fastjsonschema import compile as compile_schema, JsonSchemaException
+from jsonschema import Draft7Validator
+
+from dataclasses_jsonschema import JsonSchemaMixin
+
+from yrest.utils import FieldError
+
+_validators: Dict[type, Callable[[Dict[str, Any]], Tuple[Any, List[FieldError]]]] = {}
+
+def _field_errors(schema_validator: Draft7Validator, data: Any) -> List[FieldError]:
+  errors, seen = [], set()
+  for error in schema_validator.iter_errors(data):
+    path = [str(part) for part in error.absolute_path]
+    if error.validator == "required" and isinstance(error.instance, dict):
+      names = [".".join(path + [name]) for name in error.validator_value if name not in error.instance]
+      messages = ["This field is required"] * len(names)
+    else:
+      names, messages = [".".join(path)], [error.message]
+
+    for name, message in zip(names, messages):
+      if (name, message) not in seen:
+        seen.add((name, message))
+        errors.append(FieldError(name, message))
+
+  return errors
+
+def _compile(cls: type) -> Callable[[Dict[str, Any]], Tuple[Any, List[FieldError]]]:
+  if not (isinstance(cls, type) and issubclass(cls, JsonSchemaMixin)):
+    def build(data: Dict[str, Any]) -> Tuple[Any, List[FieldError]]:
+      try:
+        return cls(**data), []
+      except TypeError as e:
+        return None, [FieldError("", str(e))]
+
+    return build
+
+  # The formats the field encoders define by pattern, as dataclasses_jsonschema does
+  formats = {}
+  for encoder in cls._field_encoders.values():
+    if "pattern" in encoder.json_schema and "format" in encoder.json_schema:
+      formats[encoder.json_schema["format"]] = encoder.json_schema["pattern"]
+
+  schema = cls.json_schema()
+  check = compile_schema(schema, formats = formats, use_default = False)
+  # Only used to report every field error once the compiled check fails
+  schema_validator = Draft7Validator(schema)
+
+  def validate(data: Dict[str, Any]) -> Tuple[Any, List[FieldError]]:
+    try:
+      check(data)
+    except JsonSchemaException as e:
+      return None, _field_errors(schema_validator, data) or [FieldError("", e.message)]
+    return cls.from_dict(data, validate = False), []
+
+  return validate
+
+def validator(cls: type) -> Callable[[Dict[str, Any]], Tuple[Any, List[FieldError]]]:
+  """Returns the request body validator of a consumes class, compiling its JSON schema with fastjsonschema the first time
+
+  The validator returns the instance built from the data and an empty list or None and the field errors
+  """
+  try:
+    return _validators[cls]
+  except KeyError:
+    _validators[cls] = _compile(cls)
+    return _validators[cls]
@@ -1,40 +1,42 @@
 from sys import exc_info
 from traceback import format_exception
-from os.path import isfile
-from types import ModuleType
+from os import environ
 from functools import wraps
-from typing import Any, List, Dict, Union, Callable, ForwardRef, Awaitable
-from inspect import getmembers, signature, Signature, isfunction, isclass
-from dataclasses import fields, Field
-from pathlib import PurePath
+from types import ModuleType, MappingProxyType
+from typing import Any, List, Dict, Set, Tuple, Union, Callable, ForwardRef, Awaitable, AsyncIterable
+from collections import abc
+from inspect import getmembers, signature, Signature, isfunction, isclass, isawaitable
+from dataclasses import dataclass, fields, Field
 from time import perf_counter, process_time
-from asyncio import iscoroutinefunction
+from asyncio import iscoroutinefunction, gather
 import re
+from json import dumps
 from datetime import datetime
-from mimetypes import guess_type
-from email.encoders import encode_base64
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email.mime.text import MIMEText
 
-from pymongo import ASCENDING
+from pymongo import ASCENDING, UpdateOne
 from pymongo.errors import DuplicateKeyError
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
 
 from dataclasses_jsonschema import JsonSchemaMixin, ValidationError
 
-from aiosmtplib import send
-
 from sanic import Sanic, response
 from sanic.request import Request
 from sanic.log import logger
 from sanic.exceptions import abort, NotFound, Unauthorized
 
 from yrest.tree import Tree
-from yrest.mongo import MongoJSONEncoder, Mongo
+from yrest.mongo import MongoJSONEncoder, MongoBase, Mongo, table_uow
 from yrest.openapi import OpenApi
-from yrest.utils import Ok, OkResult, OkListResult, Error, ErrorMessage
-from yrest.auth import AuthToken
+from yrest.serializer import serializer
+from yrest.hydrator import hydrator
+from yrest.utils import Result, Ok, OkResult, OkListResult, Error, ErrorMessage, ValidationErrors, get_parents_paths, NDJSON
+from yrest.validator import validator
+from yrest.auth import AuthToken, default_hasher
+from yrest.cache import PermissionCache, ActorCache
+from yrest.metrics import Metrics, Stopwatch
+from yrest.snapshot import snapshot_key, load_snapshot, save_snapshot
+from yrest.mail import Mailer, DeliveryHandle, build_message
+from yrest.notify import Notifier
 
 class yJSONEncoder(MongoJSONEncoder):
   def default(self, obj):
@@ -51,44 +53,144 @@ class yJSONEncoder(MongoJSONEncoder):
 
 def timed(func):
   @wraps(func)
-  async def decorated(*args, **kwargs):
+  async def decorated(self, request: Request, *args, **kwargs):
     counter, time = perf_counter(), process_time()
+    request.ctx.timer = timer = Stopwatch()
 
     code = 200
-    result = await func(*args, **kwargs)
-    if isinstance(result, AuthToken):
-      result = result.to_dict()
-    elif isinstance(result, (Ok, Error)):
-      result = result.to_dict()
-      code = result.pop("code")
+    result = await func(self, request, *args, **kwargs)
+    if isinstance(result, Streamed):
+      return _stream(self, func.__name__, result, timer, counter, time)
+
+    with timer.stage("serialize"):
+      if isinstance(result, (AuthToken, Ok, Error)):
+        result = serializer(result.__class__)(result)
+        code = result.pop("code", code)
 
-    result["pref_counter"] = perf_counter() - counter
-    result["process_time"] = process_time() - time
+      result["pref_counter"] = perf_counter() - counter
+      result["process_time"] = process_time() - time
+      body = dumps(result, cls = yJSONEncoder, separators = (",", ":")).encode()
 
-    return response.json(result, code)
+    self._observe(func.__name__, timer, perf_counter() - counter)
+    return response.raw(body, code, headers = {"Server-Timing": timer.server_timing()}, content_type = "application/json")
   return decorated
 
+class Streamed:
+  """An async iterable result to be sent as NDJSON or as a chunked JSON array"""
+  def __init__(self, items: AsyncIterable, ndjson: bool = False, code: int = 200):
+    self.items = items
+    self.ndjson = ndjson
+    self.code = code
+
+def _stream(app: 'ySanic', route: str, result: Streamed, timer: Stopwatch, counter: float, time: float, flush_size: int = 16384) -> response.StreamingHTTPResponse:
+  """Streams the items as they arrive followed by the ok/timing envelope
+
+  NDJSON sends the envelope as the last line. JSON sends {"result": [...], "ok": ..., ...} with the envelope after the array
+  """
+  encode = lambda obj: dumps(obj, cls = yJSONEncoder, separators = (",", ":"))
+
+  async def streaming_fn(stream):
+    count, buffer, size = 0, ["" if result.ndjson else '{"result":['], 0
+    trailer = {"ok": True, "code": result.code}
+    try:
+      async for item in result.items:
+        chunk = encode(item.to_plain_dict() if isinstance(item, Tree) else item)
+        buffer.append(f"{chunk}\n" if result.ndjson else f",{chunk}" if count else chunk)
+        count, size = count + 1, size + len(chunk)
+        if size >= flush_size:
+          await stream.write("".join(buffer))
+          buffer, size = [], 0
+    except Exception as e:
+      logger.error(e)
+      trailer = {"ok": False, "code": 500, "message": str(e)}
+
+    trailer.update(count = count, pref_counter = perf_counter() - counter, process_time = process_time() - time)
+    buffer.append(f"{encode(trailer)}\n" if result.ndjson else f"],{encode(trailer)[1:]}")
+    await stream.write("".join(buffer))
+    app._observe(route, timer, perf_counter() - counter)
+
+  content_type = NDJSON if result.ndjson else "application/json"
+  return response.stream(streaming_fn, status = result.code, headers = {"Server-Timing": timer.server_timing()}, content_type = content_type)
+
+@dataclass(frozen = True)
+class Endpoint:
+  """A model member precompiled for the request handlers"""
+  member: str
+  verb: str
+  actor: bool = False
+  consumes: Any = None
+  params: Tuple[str, ...] = ()
+
+  def bind(self, request: Request, actor: Mongo = None, consume: Any = None) -> List[Any]:
+    known = {"request": request, "actor": actor, "consume": consume}
+    return [known[param] for param in self.params]
+
 class ySanic(Sanic):
-  def __init__(self, root_model: Tree, models: ModuleType, **kwargs: Dict[str, Any]):
+  def __init__(self, root_model: Tree, models: ModuleType, snapshot: str = None, **kwargs: Dict[str, Any]):
     super().__init__(**kwargs)
 
     self._root_model = root_model
     self._models = models
-
-    self._introspection = {}
-    tree = self._introspect(tree = [])
-    # print("\n".join(tree))
-    # from json import dumps
-    # logger.info(dumps(self._introspection["Group"], indent = 2, cls = yJSONEncoder))
+    self._permissions = PermissionCache(models.Permission)
+    self._actors = ActorCache(models.User)
+    self._metrics = Metrics()
+    self._metrics.describe("yrest_request_seconds", "Time spent handling a request by route and member")
+    self._metrics.describe("yrest_stage_seconds", "Time spent on each stage of a request by route and member")
+    self._metrics.describe("yrest_login_seconds", "Time spent authenticating by outcome (ok, failed or rejected)")
+    self._hasher = default_hasher
+    self.register_listener(self._start_hasher, "before_server_start")
+    self.register_listener(self._stop_hasher, "after_server_stop")
+    # before_server_stop listeners run in reverse order: notifications drain first, so they can still send their mails,
+    # then the mailer stops. The table is closed after the server stops
+    self._mailer = None
+    self.register_listener(self._stop_mailer, "before_server_stop")
+    self._notifier = Notifier(self._run_notification)
+    self._replayer = None
+    self.register_listener(self._drain_notifications, "before_server_stop")
+
+    # Workers load the introspection from the snapshot while it matches the models and yrest sources
+    self._snapshot = snapshot or environ.get("YREST_SNAPSHOT", None)
+    self._snapshot_key = snapshot_key(models, root_model.__name__) if self._snapshot else None
+    if not self._load_snapshot():
+      self._introspection = {}
+      tree = self._introspect(tree = [])
+      # print("\n".join(tree))
+      # from json import dumps
+      # logger.info(dumps(self._introspection["Group"], indent = 2, cls = yJSONEncoder))
+      if self._snapshot:
+        self.save_snapshot()
 
     self._build_routes()
 
-  def _introspect(self, model: Tree = None, analized: List[str] = None, indent: int = 0, tree: List[str] = None):
+  def _load_snapshot(self) -> bool:
+    snapshot = load_snapshot(self._snapshot, self._snapshot_key) if self._snapshot else None
+    if snapshot is None:
+      return False
+
+    self._introspection = snapshot["introspection"]
+    if isinstance(self, OpenApi):
+      self._openapi_inputs = snapshot["openapi"]
+    return True
+
+  def save_snapshot(self, path: str = None) -> str:
+    """Writes the introspection (and the OpenAPI inputs) to path or the app's snapshot path and returns where"""
+    path = path or self._snapshot
+    if path is None:
+      raise ValueError("There is no snapshot path, pass one or set YREST_SNAPSHOT")
+
+    save_snapshot(path, {
+      "key": self._snapshot_key or snapshot_key(self._models, self._root_model.__name__),
+      "introspection": self._introspection,
+      "openapi": self._build_openapi_inputs() if isinstance(self, OpenApi) else None
+    })
+    return path
+
+  def _introspect(self, model: Tree = None, analized: Set[str] = None, indent: int = 0, tree: List[str] = None):
     if model is None:
       model = self._root_model
 
     if analized is None:
-      analized = []
+      analized = set()
 
     if tree is not None:
       tab = "|  " * indent
@@ -96,7 +198,8 @@ class ySanic(Sanic):
 
     if model.__name__ not in analized:
       self._introspection[model.__name__] = self._analize(model)
-      analized.append(model.__name__)
+      hydrator(model)
+      analized.add(model.__name__)
 
     factories = []
     for field in fields(model):
@@ -127,7 +230,7 @@ class ySanic(Sanic):
     is_root = model == self._root_model
     is_recursive = getattr(model, "_is_recursive", False)
 
-    result = {}
+    result = {"params": tuple(param for param in sig.parameters if param in ("request", "actor", "consume"))}
 
     if hasattr(member, "__doc__") and member.__doc__:
       result["description"] = member.__doc__
@@ -137,6 +240,7 @@ class ySanic(Sanic):
         result["actor"] = True
       elif param_name == "consume":
         result["consumes"] = getattr(self._models, param.annotation) if isinstance(param.annotation, str) else param.annotation
+        validator(result["consumes"])
 
         urls = []
 
@@ -176,11 +280,38 @@ class ySanic(Sanic):
       if "can_crash" in member.__decorators__:
         result["can_crash"] = member.__decorators__["can_crash"]
 
-    result["produces"] = sig.return_annotation.__args__ if getattr(sig.return_annotation, "__origin__", False) == Union else sig.return_annotation
+    produces = sig.return_annotation
+    if getattr(produces, "__origin__", None) in (abc.AsyncIterator, abc.AsyncIterable, abc.AsyncGenerator):
+      result["streams"] = True
+      produces = produces.__args__[0]
+
+    result["produces"] = produces.__args__ if getattr(produces, "__origin__", False) == Union else produces
 
     return result
 
+  def _build_dispatch(self) -> MappingProxyType:
+    dispatch = {}
+    for model_name, members in self._introspection.items():
+      for name, data in members.items():
+        if name != "factories":
+          member = "index" if name == "call" else name
+          endpoint = Endpoint(member, data["verb"], data.get("actor", False), data.get("consumes", None), data["params"])
+          dispatch[(model_name, member, endpoint.verb)] = endpoint
+
+    return MappingProxyType(dispatch)
+
+  def _build_creatable(self) -> frozenset:
+    """The model names /new/<model> accepts: the create_ members and the models some other can store"""
+    creatable = {member[len("create_"):] for _, member, verb in self._dispatch if verb == "POST" and member.startswith("create_")}
+    for members in self._introspection.values():
+      creatable.update(name.lower() for name in members.get("factories", []) if hasattr(self._models, name.lower().capitalize()))
+
+    return frozenset(creatable)
+
   def _build_routes(self):
+    self._dispatch = self._build_dispatch()
+    self._creatable = self._build_creatable()
+
     if "call" in self._introspection[self._root_model.__name__]:
       self.add_route(self.dispatcher, "/", ["GET"])
       self.add_route(self._generic_options, "/", ["OPTIONS"])
@@ -199,6 +330,8 @@ class ySanic(Sanic):
       self.add_route(self.factory, "/new/<model>", ["POST"])
       self.add_route(self._generic_options, "/new/<model>", ["OPTIONS"])
 
+    self.add_route(self.metrics, "/metrics", ["GET"])
+
     if isinstance(self, OpenApi):
       self.add_route(self.openapi, "/openapi", ["GET"])
       self.add_route(self._generic_options, "/openapi", ["OPTIONS"])
@@ -219,24 +352,57 @@ class ySanic(Sanic):
     if url == "/":
       return await self._root_model.get(self._table, path = "")
 
-    url_ = PurePath(url)
-    test = 0
-    while url_ != url_.parent:
-      doc = await self._root_model._get_doc(self._table, url = str(url_))
-      if doc:
-        paper = getattr(models, doc["type"])(**doc)
-        return paper
+    candidates = get_parents_paths(url)[:tolerance + 1]
+    depths = {(c["path"], c.get("slug")): depth for depth, c in enumerate(candidates)}
 
-      test += 1
-      if test > tolerance:
-        break
+    found, deepest = None, len(candidates)
+    async for doc in self._table.find({"$or": candidates}):
+      depth = depths.get((doc["path"], doc["slug"] if doc["path"] else None), deepest)
+      if depth < deepest:
+        found, deepest = doc, depth
 
-      url_ = url_.parent
-      if str(url_) == "/":
-        return await self._root_model.get(self._table, path = "")
+    if found:
+      return getattr(models, found["type"])._from_doc(found, self._table)
 
     raise NotFound(f"{url} not found")
 
+  def _target(self, paper: Tree, path: str, verb: str, default: str) -> Tuple[str, Endpoint]:
+    url = paper.get_url()
+    member = (path[len(url) + 1:] if url > "/" else path[1:]) or default
+    return member, self._dispatch.get((paper.type, member, verb), None)
+
+  async def _get_actor(self, request: Request) -> Mongo:
+    token = AuthToken.get(request.headers)
+    return await token.get_actor(self._table, self.config["JWT_SECRET"], self._models.User, self._actors)
+
+  async def _resolve(self, request: Request, path: str, tolerance: int, permission: Callable[[Tree], str]) -> Tuple[Tree, Mongo, Mongo]:
+    """Resolves the document, its permission and the actor
+
+    The actor doesn't depend on the document so both lookups run concurrently unless CONCURRENT_LOOKUPS is disabled
+    """
+    timer = request.ctx.timer
+
+    async def paper_and_perm():
+      with timer.stage("get_path"):
+        paper = await self.get_path(path, self._models, tolerance)
+        paper._table = self._table
+
+      name = permission(paper)
+      with timer.stage("permission"):
+        return paper, await self._permissions.get(self._table, paper.type, name) if name else None
+
+    async def get_actor():
+      with timer.stage("actor"):
+        return await self._get_actor(request)
+
+    if self.config.get("CONCURRENT_LOOKUPS", True):
+      (paper, perm), actor = await gather(paper_and_perm(), get_actor())
+    else:
+      paper, perm = await paper_and_perm()
+      actor = await get_actor()
+
+    return paper, perm, actor
+
   @timed
   async def auth(self, request: Request):
     if request.json is None:
@@ -252,40 +418,35 @@ class ySanic(Sanic):
       return ErrorMessage(message = f"Data must be provided",  code = 400)
 
     path_ = f"/{path or ''}"
+    def permission(paper):
+      member, endpoint = self._target(paper, path_, "PUT", "update")
+      return member if endpoint else None
+
     try:
-      paper = await self.get_path(path_, self._models, 1)
-      paper._table = request.app._table
+      paper, perm, actor = await self._resolve(request, path_, 1, permission)
     except NotFound as e:
       return ErrorMessage(message = e.args[0], code = 404)
 
-    url = paper.get_url()
-    member = path_.replace(url, "")[1:] if url > "/" else path_[1:]
-    if not member:
-      member = "update"
+    member, endpoint = self._target(paper, path_, "PUT", "update")
+    if endpoint is None:
+      return ErrorMessage(message = f"{path_} not found", code = 404)
 
-    perm = await self._models.Permission.get(self._table, context = paper.type, name = member)
-    token = AuthToken.get(request.headers)
-    actor = await token.get_actor(self._table, self.config["JWT_SECRET"], self._models.User)
-    # actor = await self._models.User.get(self._table, slug = "garito")
+    timer = request.ctx.timer
+    timer.member = member
     if not perm or not await perm.allows(actor, paper):
       return ErrorMessage(message = "Unauthorized", code = 401)
 
-    args = [request]
-    _introspection = self._introspection[paper.type]["call" if member == "index" else member]
-    if "actor" in _introspection:
-      args.append(actor)
+    with timer.stage("validate"):
+      consume, errors = validator(endpoint.consumes)(request.json)
+    if errors:
+      return ValidationErrors(message = "Validation error", errors = errors)
 
-    consumes = _introspection.get("consumes", None)
     try:
-      model = consumes(**request.json)
-      args.append(model)
-    except TypeError as e:
-      return ErrorMessage(message = f"Validation error: {e}", code = 400)
-
-    try:
-      result = await getattr(paper, member)(*args)
+      with timer.stage("member"):
+        result = await getattr(paper, member)(*endpoint.bind(request, actor, consume))
       if isinstance(result, Tree):
-        result = result.to_plain_dict()
+        with timer.stage("serialize"):
+          result = result.to_plain_dict()
       return OkListResult(result = result, code = 200) if isinstance(result, list) else  OkResult(result = result, code = 200)
     except Exception as e:
       message = format_exception(*exc_info()) if request.app.config.get("DEBUG", False) else str(e)
@@ -296,34 +457,37 @@ class ySanic(Sanic):
   @timed
   async def dispatcher(self, request, path: str = None):
     path_ = f"/{path or ''}"
+    def permission(paper):
+      member, endpoint = self._target(paper, path_, "GET", "index")
+      return ("call" if member == "index" else member) if endpoint else None
+
     try:
-      paper = await self.get_path(path_, self._models, 1)
-      paper._table = request.app._table
+      paper, perm, actor = await self._resolve(request, path_, 1, permission)
     except NotFound as e:
       return ErrorMessage(message = e.args[0], code = 404)
 
-    url = paper.get_url()
-    member = path_.replace(url, "")[1:] if url > "/" else path_[1:]
-    if not member:
-      member = "index"
+    member, endpoint = self._target(paper, path_, "GET", "index")
+    if endpoint is None:
+      return ErrorMessage(message = f"{path_} not found", code = 404)
 
-    perm = await self._models.Permission.get(self._table, context = paper.type, name = "call" if member == "index" else member)
-    token = AuthToken.get(request.headers)
-    actor = await token.get_actor(self._table, self.config["JWT_SECRET"], self._models.User)
-    # actor = await self._models.User.get(self._table, slug = "garito")
+    timer = request.ctx.timer
+    timer.member = member
     if not perm or not await perm.allows(actor, paper):
       return ErrorMessage(message = "Unauthorized", code = 401)
 
-    args = [request]
-
-    _introspection = self._introspection[paper.type]["call" if member == "index" else member]
-    if "actor" in _introspection:
-      args.append(actor)
+    if member == "index" and request.args.get("embed", None) == "children":
+      return await self._embed(request, paper, actor)
 
     try:
-      result = await getattr(paper, member)(*args)
+      with timer.stage("member"):
+        result = getattr(paper, member)(*endpoint.bind(request, actor))
+        if isawaitable(result):
+          result = await result
+      if hasattr(result, "__aiter__"):
+        return Streamed(result, NDJSON in request.headers.get("accept", ""))
       if isinstance(result, Tree):
-        result = result.to_plain_dict()
+        with timer.stage("serialize"):
+          result = result.to_plain_dict()
       return OkListResult(result = result, code = 200) if isinstance(result, list) else  OkResult(result = result, code = 200)
     except Exception as e:
       message = format_exception(*exc_info()) if request.app.config.get("DEBUG", False) else str(e)
@@ -331,44 +495,62 @@ class ySanic(Sanic):
         logger.error(line)
       return ErrorMessage(message = message, code = 500)
 
+  async def _embed(self, request: Request, paper: Mongo, actor: Mongo) -> Result:
+    """Returns the document with the subtree the actor may call mounted (?embed=children&depth=N&types=A,B)"""
+    try:
+      depth = max(min(int(request.args.get("depth", 1)), self.config.get("EMBED_MAX_DEPTH", 5)), 1)
+    except ValueError:
+      return ErrorMessage(message = "depth must be an integer", code = 400)
+
+    perms = {}
+    async def allowed(obj: Mongo) -> bool:
+      if obj.type not in perms:
+        perms[obj.type] = await self._permissions.get(self._table, obj.type, "call")
+      return perms[obj.type] is not None and await perms[obj.type].allows(actor, obj)
+
+    types = request.args.get("types", None)
+    with request.ctx.timer.stage("member"):
+      result = await paper.subtree(self._models, depth, types.split(",") if types else None, allowed)
+    return OkResult(result = result, code = 200)
+
   @timed
   async def factory(self, request, model, path: str = None):
     path_ = f"/{path or ''}"
+    # Unknown models never reach the permission cache
+    if model not in self._creatable:
+      return ErrorMessage(message = f"{model} can't be created", code = 404)
+
     try:
-      paper = await self.get_path(path_, self._models, 0)
-      paper._table = request.app._table
+      paper, perm, actor = await self._resolve(request, path_, 0, lambda paper: f"create_{model}")
     except NotFound as e:
       return ErrorMessage(message = e.args[0], code = 404)
 
-    if f"create_{model}" in self._introspection[paper.__class__.__name__]:
-      theModel = self._introspection[paper.__class__.__name__][f"create_{model}"]["consumes"]
-    else:
-      theModel = getattr(self._models, model.capitalize())
+    endpoint = self._dispatch.get((paper.type, f"create_{model}", "POST"), None)
+    theModel = getattr(self._models, model.capitalize()) if endpoint is None else endpoint.consumes
 
-    try:
-      consume = theModel.from_dict(request.json)
-    except TypeError as e:
-      return ErrorMessage(message = e.args, code = 400)
+    timer = request.ctx.timer
+    timer.member = f"create_{model}"
+    with timer.stage("validate"):
+      consume, errors = validator(theModel)(request.json)
+    if errors:
+      return ValidationErrors(message = "Validation error", errors = errors)
 
-    perm = await self._models.Permission.get(self._table, context = paper.type, name = f"create_{model}")
-    token = AuthToken.get(request.headers)
-    actor = await token.get_actor(self._table, self.config["JWT_SECRET"], self._models.User)
-    # actor = await self._models.User.get(self._table, slug = "garito")
-    if not await perm.allows(actor, paper):
+    if not perm or not await perm.allows(actor, paper):
       return ErrorMessage(message = "Unauthorized", code = 401)
 
-    member = getattr(paper, f"create_{model}", None)
-    if member is None:
+    if endpoint is None:
       member = self._generic_factory
       args = [request, paper, actor, consume]
     else:
-      known = {"request": request, "actor": actor, "consume": consume}
-      args = [known[param] for param in signature(member).parameters if param in known.keys()]
+      member = getattr(paper, endpoint.member)
+      args = endpoint.bind(request, actor, consume)
 
     try:
-      result = await member(*args)
+      with timer.stage("member"):
+        result = await member(*args)
       if isinstance(result, Tree):
-        result = result.to_plain_dict()
+        with timer.stage("serialize"):
+          result = result.to_plain_dict()
       return OkResult(result = result, code = 201)
     except DuplicateKeyError:
       return ErrorMessage(message = f"{consume.name} already exists @ {paper.name}", code = 409)
@@ -377,27 +559,26 @@ class ySanic(Sanic):
   async def remover(self, request: Request, path: str = None):
     path_ = f"/{path or ''}"
     try:
-      paper = await self.get_path(path_, self._models, 0)
-      paper._table = request.app._table
+      paper, perm, actor = await self._resolve(request, path_, 0, lambda paper: "remove")
     except NotFound as e:
       return ErrorMessage(message = e.args[0], code = 404)
 
-    perm = await self._models.Permission.get(self._table, context = paper.type, name = "remove")
-    token = AuthToken.get(request.headers)
-    actor = await token.get_actor(self._table, self.config["JWT_SECRET"], self._models.User)
-    # actor = await self._models.User.get(self._table, slug = "garito")
-    if not await perm.allows(actor, paper):
+    timer = request.ctx.timer
+    timer.member = "remove"
+    if not perm or not await perm.allows(actor, paper):
       return ErrorMessage(message = "Unauthorized", code = 401)
 
-    member = getattr(paper, "remove")
-    if member is None:
+    endpoint = self._dispatch.get((paper.type, "remove", "DELETE"), None)
+    if endpoint is None:
       member = self._generic_remover
       args = [request, paper, actor]
     else:
-      args = [request, actor]
+      member = getattr(paper, endpoint.member)
+      args = endpoint.bind(request, actor)
 
     try:
-      result = await member(*args)
+      with timer.stage("member"):
+        result = await member(*args)
       return OkListResult(result = result)
     except Exception as e:
       message = format_exception(*exc_info()) if request.app.config.get("DEBUG", False) else str(e)
@@ -406,37 +587,69 @@ class ySanic(Sanic):
       return ErrorMessage(message = message, code = 500)
 
   async def _generic_factory(self, request: Request, paper: Mongo, actor, consume, update_roles: bool = True):
-    # this could be executed in a mongo transaction
-    await paper.create_child(consume, request.app._models)
+    # The actor's roles change in memory only once the child is written, a failed request leaves it untouched
+    async with table_uow(paper._table) as uow:
+      await paper.create_child(consume, request.app._models)
+
+      # This assumes the actor should be the owner
+      # Here we could implement a mechanism to allow delegation (when a user makes and action on behalf another user)
+      # Or perhaps is better to delegate this decision to the model
+      owner = f"owner@{consume.get_url()}"
+      if update_roles:
+        def granted():
+          if owner not in actor.roles:
+            actor.roles.append(owner)
+        uow.add([UpdateOne({"_id": actor._id}, {"$addToSet": {"roles": owner}})], actor, "update", granted)
 
-    # This assumes the actor should be the owner
-    # Here we could implement a mechanism to allow delegation (when a user makes and action on behalf another user)
-    # Or perhaps is better to delegate this decision to the model
-    roles = actor.roles
-    roles.append(f"owner@{consume.get_url()}")
-    if update_roles:
-      await actor.update(request.app._models, roles = roles)
+    if not update_roles:
+      actor.add_to_set("roles", owner)
 
-    return {"object": consume.to_plain_dict(), "actor_roles": roles}
+    return {"object": consume.to_plain_dict(), "actor_roles": actor.roles}
 
   async def _generic_remover(self, request: Request, paper: Mongo, actor, update_roles: bool = True):
     # this assumes that the actor is the owner. Meh...
-    roles = actor.roles
-    roles.pop(roles.index(f"owner@{paper.get_url()}"))
+    owner = f"owner@{paper.get_url()}"
+    if owner not in actor.roles:
+      raise ValueError(f"{owner} not in the actor's roles")
 
-    await paper.delete(request.app._models)
-    await actor.update(request.app._models, roles = roles)
+    async with table_uow(paper._table) as uow:
+      await paper.delete(request.app._models)
+      if update_roles:
+        def revoked():
+          actor.roles[:] = [role for role in actor.roles if role != owner]
+        uow.add([UpdateOne({"_id": actor._id}, {"$pull": {"roles": owner}})], actor, "update", revoked)
 
-    return roles
+    if not update_roles:
+      actor.pull("roles", owner)
 
-  async def notify(self, request, notification: str, **kwargs) -> bool:
+    return actor.roles
+
+  async def notify(self, request, notification: str, background: bool = False, **kwargs) -> bool:
+    """Runs the notification member, or with background schedules it and returns right away
+
+    Background notifications are stored in the outbox first when NOTIFY_OUTBOX is set, replayed ones get request = None
+    """
     member = getattr(self, notification, None)
     if member is None:
       raise NotFound(f"The server hasn't {notification} as notification")
 
+    if background:
+      await self._notifier.dispatch(notification, request, kwargs)
+      return True
+
     return await member(request, **kwargs)
 
-  async def send_email(self, to: str, subject: str, from_: str = None, text: str = None, html: str = None, attachments: Any = None) -> bool:
+  async def _run_notification(self, notification: str, request: Request, kwargs: Dict[str, Any]) -> Any:
+    return await getattr(self, notification)(request, **kwargs)
+
+  async def _drain_notifications(self, app, loop):
+    if app._replayer is not None:
+      app._replayer.cancel()
+      app._replayer = None
+    await app._notifier.drain(app.config.get("NOTIFY_DRAIN_TIMEOUT", 30))
+
+  async def send_email(self, to: str, subject: str, from_: str = None, text: str = None, html: str = None, attachments: Any = None) -> DeliveryHandle:
+    """Queues the message for delivery and returns its handle (await it to wait for the server's response)"""
     if from_ is None:
         from_ = self.config["MAIL_SENDER"]
 
@@ -448,41 +661,45 @@ class ySanic(Sanic):
       logger.info(html)
       logger.info(attachments)
     else:
-      if text is None and html is None:
-        raise ValidationError("Neither text nor html has been provided")
-      elif text is not None and html is not None:
-        message = MIMEMultipart("alternative")
-        message.attach(MIMEText(text))
-        message.attach(MIMEText(html, "html"))
-      elif html is not None and attachments:
-        message = MIMEMultipart()
-        message.attach(MIMEText(html, "html"))
-      elif text is None:
-        message = MIMEText(html, "html")
-      else:
-        message = MIMEText(text)
-
-      if attachments:
-        for idx, attachment in enumerate(attachments):
-          if isfile(attachment):
-            m_type = guess_type(attachment)[0]
-            main_type, subtype = m_type.split('/', 1)
-            attach = MIMEBase(main_type, subtype)
-            with open(attachment, 'rb') as f:
-              attach.set_payload(f.read())
-            encode_base64(attach)
-            attach.add_header("Content-Disposition", "attachment", filename = attachment)
-            attach.add_header("X-Attachment-Id", str(idx))
-            attach.add_header("Content-ID", f"<{idx}>")
-            message.attach(attach)
-          else:
-            logger.warn(f"{attachment} is not a file")
-
-      message["From"] = from_
-      message["To"] = to
-      message["Subject"] = subject
-
-      return await send(message, hostname = self.config["MAIL_SERVER"], port = self.config["MAIL_PORT"], **self.config.get("MAIL_ARGS", {}))
+      try:
+        message = await build_message(from_, to, subject, text, html, attachments)
+      except ValueError as e:
+        raise ValidationError(e.args[0])
+
+      if self._mailer is None:
+        self._mailer = Mailer.from_config(self.config)
+      return self._mailer.enqueue(message)
+
+  async def _stop_mailer(self, app, loop):
+    if app._mailer is not None:
+      await app._mailer.stop(app.config.get("MAIL_DRAIN_TIMEOUT", 30))
+      app._mailer = None
+
+  def _observe(self, route: str, timer: Stopwatch, total: float):
+    member = timer.member or ""
+    for stage, seconds in timer.stages.items():
+      self._metrics.observe("yrest_stage_seconds", seconds, route = route, member = member, stage = stage)
+    self._metrics.observe("yrest_request_seconds", total, route = route, member = member)
+
+  async def metrics(self, request: Request):
+    """Returns the latency histograms and cache counters in Prometheus text format"""
+    caches = {"permission": self._permissions.stats(), "actor": self._actors.stats()}
+    counters = {
+      "yrest_cache_hits_total": {(("cache", name),): stats["hits"] for name, stats in caches.items()},
+      "yrest_cache_misses_total": {(("cache", name),): stats["misses"] for name, stats in caches.items()},
+      "yrest_password_rejected_total": {(): self._hasher.rejected}
+    }
+    return response.text(self._metrics.render(counters), content_type = "text/plain; version=0.0.4")
+
+  def _start_hasher(self, app, loop):
+    app._hasher.configure(
+      app.config.get("PASSWORD_WORKERS", 4),
+      app.config.get("PASSWORD_QUEUE", 64),
+      app.config.get("PASSWORD_PROCESSES", False)
+    )
+
+  def _stop_hasher(self, app, loop):
+    app._hasher.shutdown()
 
   async def _generic_options(self, request, *args, **kwargs):
     return response.text("", status = 204)
@@ -497,7 +714,7 @@ class MongoServer(ySanic):
     super().__init__(root_model, models, **kwargs)
 
     self.register_listener(self._set_table, 'before_server_start')
-    self.register_listener(self._close_table, 'before_server_stop')
+    self.register_listener(self._close_table, 'after_server_stop')
 
   async def _set_table(self, app, loop):
     app._client = AsyncIOMotorClient(app.config["MONGO_URI"], io_loop = loop)
@@ -509,10 +726,24 @@ class MongoServer(ySanic):
 
     app._table.create_index("created_at", expireAfterSeconds = 1800)
     app._table.create_index([("path", ASCENDING), ("slug", ASCENDING)], unique = True)
+    if app.config.get("MONGO_ANCESTORS", False):
+      MongoBase._materialized = True
+      app._table.create_index([("ancestors", ASCENDING), ("depth", ASCENDING)])
+
+    if app.config.get("NOTIFY_OUTBOX", False):
+      app._table.create_index([("type", ASCENDING), ("claimed_at", ASCENDING)])
+      app._notifier.configure(app.config.get("NOTIFY_CONCURRENCY", 10), app._table, app.config.get("NOTIFY_LEASE", 300), app.config.get("NOTIFY_MAX_ATTEMPTS", 5))
+      app._replayer = loop.create_task(app._notifier.replay_forever())
+    else:
+      app._notifier.configure(app.config.get("NOTIFY_CONCURRENCY", 10))
+    app._actors.configure(app.config.get("ACTOR_CACHE_SIZE", 1024), app.config.get("ACTOR_CACHE_TTL", 60))
+    app._permissions.configure(app.config.get("PERMISSION_CACHE_TTL", 60))
 
     root = await app._root_model.get(app._table, path = "")
     if root:
       await root._rebuild_sec(app)
+    # After the rebuild, which may have written permissions
+    await app._permissions.load(app._table)
 
   def _close_table(self, app, loop):
     app._client.close()